@@ -7,7 +7,13 @@ from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 
-from langchain_anthropic import ChatAnthropic
+from langchain_core.runnables import RunnableLambda
+
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.scheduler import scheduled
+from utils.cascade import confident, default_cascade
 
 
 # setup environment ----------------------------------------------
@@ -24,8 +30,18 @@ def _set_env(var: str):
 _set_env("ANTHROPIC_API_KEY")
 
 
-# llm = ChatAnthropic(model="claude-3-5-sonnet-20240620") # slow, expensive, most accurate
-llm = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
+# from utils.clients import get_chat_model
+# llm = get_chat_model("claude-3-5-sonnet-20240620") # slow, expensive, most accurate
+# llm = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
+
+# NEW: both - haiku answers first, and only answers that hedge ("I don't
+# know", ...) or were cut off are asked again with sonnet (utils/cascade.py)
+llm = default_cascade(checks=[confident()])
+cascade = llm
+
+# all calls go through the shared request scheduler (queue, concurrency and
+# rate limits, dedup of identical in-flight prompts), see utils/scheduler.py
+llm = scheduled(llm)
 
 # ----------------------------------------------------------------
 
@@ -44,6 +60,12 @@ class State(TypedDict):
 def chatbot(state: State):
     return {"messages": [llm.invoke(state["messages"])]}
 
+# async variant of the chatbot node - used when the graph is run with
+# ainvoke() / astream(), so the node awaits the model instead of
+# blocking an executor thread
+async def achatbot(state: State):
+    return {"messages": [await llm.ainvoke(state["messages"])]}
+
 # helper function to print graph updates (= chatbot responses)
 # as they happen
 def stream_graph_updates(graph, user_input: str):
@@ -51,11 +73,19 @@ def stream_graph_updates(graph, user_input: str):
         for value in event.values():
             print("Assistant:", value["messages"][-1].content)
 
+# async version of the helper above, for running the graph on an event loop
+async def astream_graph_updates(graph, user_input: str):
+    async for event in graph.astream({"messages": [{"role": "user", "content": user_input}]}):
+        for value in event.values():
+            print("Assistant:", value["messages"][-1].content)
+
 def main():
 
     # build the graph
     graph_builder = StateGraph(State)
-    graph_builder.add_node("chatbot", chatbot)
+    # wrapping both variants lets the graph pick the sync node for
+    # invoke()/stream() and the async node for ainvoke()/astream()
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
 
     graph_builder.add_edge(START, "chatbot")
     graph_builder.add_edge("chatbot", END)
@@ -71,6 +101,7 @@ def main():
         user_input = input("User: ")
         if user_input.lower() in ["quit", "exit", "q"]:
             print("Goodbye!")
+            print("Model tiers:", cascade.stats.report())
             break
         else:
             stream_graph_updates(graph, user_input)
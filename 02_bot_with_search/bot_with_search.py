@@ -7,13 +7,20 @@ from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 
-from langchain_anthropic import ChatAnthropic
 
 # NEW
-from langchain_community.tools.tavily_search import TavilySearchResults
 import json
-from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+import asyncio
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.clients import get_chat_model
+from utils.tavily import get_tavily_tool
+from utils.scheduler import scheduled
+from utils.speculative import SpeculativeToolExecutor
+from utils.blobs import get_blob_store, materialize, tool_message
 
 
 # setup environment ----------------------------------------------
@@ -33,17 +40,35 @@ _set_env("TAVILY_API_KEY", file_name="../tavily_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-# llm = ChatAnthropic(model="claude-3-5-sonnet-20240620") # slow, expensive, most accurate
-llm = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
+# llm = get_chat_model("claude-3-5-sonnet-20240620") # slow, expensive, most accurate
+llm = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
 
-tool = TavilySearchResults(max_results=1)
+tool = get_tavily_tool(max_results=1)
 tools = [tool]
 tool.invoke("How is the weather in Paris?")
 
 # bind the tools to the language model - this allows the language model to use the quittools
 # but it will not yet use them unless they are explicitly called in the graph
 # we will have to add the tools to a new node
-llm_with_tools = llm.bind_tools(tools)
+# all calls go through the shared request scheduler (queue, concurrency and
+# rate limits, dedup of identical in-flight prompts), see utils/scheduler.py
+llm_with_tools = scheduled(llm.bind_tools(tools))
+
+# streaming mode: the chatbot node streams the answer and every Tavily call
+# is started as soon as its arguments are complete, while the model is still
+# generating. The tool node then picks up the running calls (utils/speculative.py).
+# Off by default: a speculative search that does not make it into the final
+# message has still been paid for. At most SPECULATIVE_SEARCHES of them run at
+# once across all sessions of this process; further ones wait for a free slot.
+SPECULATE = False
+SPECULATIVE_SEARCHES = 4
+speculative_tools = SpeculativeToolExecutor(tools, max_workers=SPECULATIVE_SEARCHES)
+
+# search results larger than 2 KB are kept out of the graph state: the
+# ToolMessage only holds a preview and a reference into this content-addressed
+# store, the chatbot node loads them back for the model call that answers
+# them (utils/blobs.py). Set to None to keep all results inline.
+blob_store = get_blob_store("disk", "blobs")
 
 # ----------------------------------------------------------------
 
@@ -63,29 +88,52 @@ class State(TypedDict):
 class BasicToolNode:
     
     # gets inialized by the user with a list of tools
-    def __init__(self, tools: list) -> None:
+    # (and optionally a SpeculativeToolExecutor that already started some
+    # of the calls while the model was streaming, and a blob store for
+    # large results)
+    def __init__(self, tools: list, speculative=None, blobs=None) -> None:
         self.tools_by_name = {tool.name: tool for tool in tools}
+        self.speculative = speculative
+        self.blobs = blobs
 
     # gets called with a dictionary of inputs (= commands, messages)
     # and hands them over to the tools
     # returns a dictionary of outputs of the respective tools
-    def __call__(self, inputs: dict):
+    def __call__(self, inputs: dict, config: RunnableConfig):
         if messages := inputs.get("messages", []):
             message = messages[-1]
         else:
             raise ValueError("No message found in input")
         outputs = []
         for tool_call in message.tool_calls:
-            tool_result = self.tools_by_name[tool_call["name"]].invoke(
-                tool_call["args"]
-            )
-            outputs.append(
-                ToolMessage(
-                    content=json.dumps(tool_result),
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"],
+            if self.speculative is not None:
+                tool_result = self.speculative.invoke(tool_call, config)
+            else:
+                tool_result = self.tools_by_name[tool_call["name"]].invoke(
+                    tool_call["args"], config
                 )
+            outputs.append(tool_message(json.dumps(tool_result), tool_call, self.blobs))
+        return {"messages": outputs}
+
+    # async variant: runs all requested tool calls concurrently
+    # via the tools' ainvoke() instead of one after the other
+    async def acall(self, inputs: dict, config: RunnableConfig):
+        if messages := inputs.get("messages", []):
+            message = messages[-1]
+        else:
+            raise ValueError("No message found in input")
+        tool_results = await asyncio.gather(
+            *(
+                self.speculative.ainvoke(tool_call, config)
+                if self.speculative is not None
+                else self.tools_by_name[tool_call["name"]].ainvoke(tool_call["args"], config)
+                for tool_call in message.tool_calls
             )
+        )
+        outputs = [
+            tool_message(json.dumps(tool_result), tool_call, self.blobs)
+            for tool_call, tool_result in zip(message.tool_calls, tool_results)
+        ]
         return {"messages": outputs}
 
 # ----------------------------------------------------------------
@@ -93,8 +141,19 @@ class BasicToolNode:
 # chatbot node function takes the current State as input and 
 # returns a dictionary containing an updated messages list 
 # under the key "messages"
-def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+def chatbot(state: State, config: RunnableConfig):
+    messages = materialize(state["messages"], blob_store) if blob_store else state["messages"]
+    if SPECULATE:
+        # the node's config also goes to the tool calls started while streaming
+        return {"messages": [speculative_tools.stream(llm_with_tools, messages, config)]}
+    return {"messages": [llm_with_tools.invoke(messages, config)]}
+
+# async variant of the chatbot node, used by ainvoke() / astream()
+async def achatbot(state: State, config: RunnableConfig):
+    messages = materialize(state["messages"], blob_store) if blob_store else state["messages"]
+    if SPECULATE:
+        return {"messages": [await speculative_tools.astream(llm_with_tools, messages, config)]}
+    return {"messages": [await llm_with_tools.ainvoke(messages, config)]}
 
 # helper function to print graph updates (= chatbot responses)
 # as they happen
@@ -103,6 +162,12 @@ def stream_graph_updates(graph, user_input: str):
         for value in event.values():
             print("Assistant:", value["messages"][-1].content)
 
+# async version of the helper above, for running the graph on an event loop
+async def astream_graph_updates(graph, user_input: str):
+    async for event in graph.astream({"messages": [{"role": "user", "content": user_input}]}):
+        for value in event.values():
+            print("Assistant:", value["messages"][-1].content)
+
 
 # Use in the conditional_edge to route to the ToolNode if the last message
 # has tool calls. Otherwise, route to the end.
@@ -132,10 +197,14 @@ def main():
     # build the graph
     graph_builder = StateGraph(State)
 
-    graph_builder.add_node("chatbot", chatbot)
+    # wrapping both variants lets the graph pick the sync node for
+    # invoke()/stream() and the async node for ainvoke()/astream()
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
     
-    tool_node = BasicToolNode(tools=[tool])
-    graph_builder.add_node("tools", tool_node)
+    tool_node = BasicToolNode(
+        tools=[tool], speculative=speculative_tools if SPECULATE else None, blobs=blob_store
+    )
+    graph_builder.add_node("tools", RunnableLambda(tool_node, afunc=tool_node.acall))
     
     graph_builder.add_edge(START, "chatbot")
 
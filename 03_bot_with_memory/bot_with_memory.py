@@ -3,9 +3,8 @@ import os
 
 from typing import Annotated
 
-from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableLambda
 from typing_extensions import TypedDict
 
 from langgraph.graph import StateGraph, START, END
@@ -17,6 +16,15 @@ from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import ToolNode, tools_condition
 # we use the langchain built in ToolNode now
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.clients import get_chat_model
+from utils.tavily import get_tavily_tool
+from utils.scheduler import scheduled
+from utils.serde import get_serde
+from utils.profiler import with_profiling
+
 
 # setup environment ----------------------------------------------
 
@@ -35,17 +43,19 @@ _set_env("TAVILY_API_KEY", file_name="../tavily_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-# llm = ChatAnthropic(model="claude-3-5-sonnet-20240620") # slow, expensive, most accurate
-llm = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
+# llm = get_chat_model("claude-3-5-sonnet-20240620") # slow, expensive, most accurate
+llm = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
 
-tool = TavilySearchResults(max_results=1)
+tool = get_tavily_tool(max_results=1)
 tools = [tool]
 tool.invoke("How is the weather in Paris?")
 
 # bind the tools to the language model - this allows the language model to use the quittools
 # but it will not yet use them unless they are explicitly called in the graph
 # we will have to add the tools to a new node
-llm_with_tools = llm.bind_tools(tools)
+# all calls go through the shared request scheduler (queue, concurrency and
+# rate limits, dedup of identical in-flight prompts), see utils/scheduler.py
+llm_with_tools = scheduled(llm.bind_tools(tools))
 
 # ----------------------------------------------------------------
 
@@ -64,6 +74,11 @@ class State(TypedDict):
 def chatbot(state: State):
     return {"messages": [llm_with_tools.invoke(state["messages"])]}
 
+# async variant of the chatbot node, used by ainvoke() / astream()
+# (the prebuilt ToolNode already supports both)
+async def achatbot(state: State):
+    return {"messages": [await llm_with_tools.ainvoke(state["messages"])]}
+
 
 # helper function to print graph updates (= chatbot responses)
 # as they happen
@@ -82,12 +97,22 @@ def stream_graph_updates(graph, config, user_input):
     for event in events:
         event["messages"][-1].pretty_print()
 
+# async version of the helper above, for running the graph on an event loop
+async def astream_graph_updates(graph, config, user_input):
+    events = graph.astream(
+        {"messages": [{"role": "user", "content": user_input}]},
+        config,
+        stream_mode="values",
+    )
+    async for event in events:
+        event["messages"][-1].pretty_print()
+
 def main():
 
     # build the graph
     graph_builder = StateGraph(State)
 
-    graph_builder.add_node("chatbot", chatbot)
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
     
     tool_node = ToolNode(tools=[tool])
     graph_builder.add_node("tools", tool_node)
@@ -104,7 +129,9 @@ def main():
     # create a MemorySaver checkpointer to save the state of the graph
     # this will work in-memory for now, but can be extended to save to disk
     # or a database (see SqliteSaver or PostgresSaver)
-    memory = MemorySaver()
+    # The messages are stored in a compact msgpack format (utils/serde.py);
+    # use get_serde("default") for LangGraph's standard serializer
+    memory = MemorySaver(serde=get_serde("msgpack"))
     graph = graph_builder.compile(checkpointer=memory)
 
 
@@ -114,6 +141,8 @@ def main():
 
 
     config = {"configurable": {"thread_id": "1"}}
+    # set "profile": True in "configurable" (or run with GRAPH_PROFILE=1) to
+    # write a collapsed-stack profile of every turn to profiles/ (utils/profiler.py)
 
     # run graph as full chatbot - as before
     while True:
@@ -122,7 +151,7 @@ def main():
             print("Goodbye!")
             break
         else:
-            stream_graph_updates(graph, config, user_input)
+            stream_graph_updates(graph, with_profiling(config), user_input)
 
     print("\n\n Snapshot of the current graph state:")
     snapshot = graph.get_state(config)
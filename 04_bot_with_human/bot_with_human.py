@@ -1,11 +1,10 @@
 import getpass
 import os
+import uuid
 
 from typing import Annotated
 from typing_extensions import TypedDict
 
-from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
@@ -13,6 +12,7 @@ from langgraph.checkpoint.memory import MemorySaver
 
 from langchain_core.tools import tool
 from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.prebuilt import ToolNode, tools_condition
 
 # NEW
@@ -20,6 +20,18 @@ from typing_extensions import Literal
 from langgraph.types import Command, interrupt
 # we use the langchain capability to interrupt the graph now
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.clients import get_chat_model
+from utils.tavily import get_tavily_tool
+from utils.scheduler import scheduled
+from utils.blobs import get_blob_store, materialize, tool_message
+
+# pending reviews + checkpoints are kept in a local SQLite file, so they
+# survive restarts and can be resumed from any worker process
+from review_store import ReviewStore, durable_checkpointer
+
 
 # setup environment ----------------------------------------------
 
@@ -55,11 +67,16 @@ def weather_search(city: str):
     return f"Weather in {city} is sunny today!"
 
 # another tool that searches for information online
-tavi_tool = TavilySearchResults(max_results=1)
+tavi_tool = get_tavily_tool(max_results=1)
 
 
 tools = [weather_search]
 
+# tool results larger than 2 KB are kept out of the checkpoints: they go into
+# a content-addressed blob table in the same SQLite file, the state only keeps
+# a preview and the reference (utils/blobs.py)
+blob_store = get_blob_store("sqlite", "reviews.sqlite")
+
 # -----------------------------------------------------------------------
 
 # define a node that, per se, does nothing except
@@ -122,24 +139,30 @@ def human_review_node(state) -> Command[Literal["chatbot", "run_tool"]]:
         return Command(goto="chatbot", update={"messages": [tool_message]})
 
 
+# (tool, tool_call) pairs for the tool calls of the last message,
+# shared by run_tool and arun_tool
+def pending_tool_calls(state):
+    tools = {"weather_search": weather_search}
+    return [(tools[tool_call["name"]], tool_call)
+            for tool_call in state["messages"][-1].tool_calls]
+
+
 def run_tool(state):
 
     new_messages = []
-    tools = {"weather_search": weather_search}
-
-    tool_calls = state["messages"][-1].tool_calls
-    
-    for tool_call in tool_calls:
-        tool = tools[tool_call["name"]]
+    for tool, tool_call in pending_tool_calls(state):
         result = tool.invoke(tool_call["args"])
-        new_messages.append(
-            {
-                "role": "tool",
-                "name": tool_call["name"],
-                "content": result,
-                "tool_call_id": tool_call["id"],
-            }
-        )
+        new_messages.append(tool_message(result, tool_call, blob_store))
+    return {"messages": new_messages}
+
+
+# async variant of run_tool, used by ainvoke() / astream()
+async def arun_tool(state):
+
+    new_messages = []
+    for tool, tool_call in pending_tool_calls(state):
+        result = await tool.ainvoke(tool_call["args"])
+        new_messages.append(tool_message(result, tool_call, blob_store))
     return {"messages": new_messages}
 
 
@@ -152,8 +175,10 @@ def route_after_llm(state) -> Literal[END, "human_review_node"]:
         return "human_review_node"
 
 
-llm = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
-llm_with_tools = llm.bind_tools(tools)
+llm = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
+# all calls go through the shared request scheduler (queue, concurrency and
+# rate limits, dedup of identical in-flight prompts), see utils/scheduler.py
+llm_with_tools = scheduled(llm.bind_tools(tools))
 
 # ----------------------------------------------------------------
 
@@ -161,7 +186,10 @@ class State(TypedDict):
     messages: Annotated[list, add_messages]
 
 def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+    return {"messages": [llm_with_tools.invoke(materialize(state["messages"], blob_store))]}
+
+async def achatbot(state: State):
+    return {"messages": [await llm_with_tools.ainvoke(materialize(state["messages"], blob_store))]}
 
 
 def stream_graph_updates(graph, config, user_input):
@@ -174,26 +202,54 @@ def stream_graph_updates(graph, config, user_input):
     for event in events:
         event["messages"][-1].pretty_print()
 
-def main():
+# async version of the helper above, for running the graph on an event loop;
+# the graph needs an async checkpointer for that, e.g.
+#   async with review_store.adurable_checkpointer(reviews.path) as checkpointer:
+#       await astream_graph_updates(build_graph(checkpointer), config, user_input)
+async def astream_graph_updates(graph, config, user_input):
+    events = graph.astream(
+        {"messages": [{"role": "user", "content": user_input}]},
+        config,
+        stream_mode="values",
+    )
+    async for event in events:
+        event["messages"][-1].pretty_print()
+
+# builds the compiled graph - also used by other worker processes that
+# resume pending reviews (see review_store.py)
+def build_graph(checkpointer):
 
     builder = StateGraph(State)
-    builder.add_node(chatbot)
-    builder.add_node(run_tool)
+    # wrapping both variants lets the graph pick the sync node for
+    # invoke()/stream() and the async node for ainvoke()/astream()
+    builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot))
+    builder.add_node("run_tool", RunnableLambda(run_tool, afunc=arun_tool))
     builder.add_node(human_review_node)
     builder.add_edge(START, "chatbot")
     builder.add_conditional_edges("chatbot", route_after_llm)
     builder.add_edge("run_tool", "chatbot")
 
-    memory = MemorySaver()
-    graph = builder.compile(checkpointer=memory)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def main():
+
+    # NEW: instead of the in-process MemorySaver, keep the checkpoints in
+    # SQLite so pending interrupts outlive this process
+    # graph = build_graph(MemorySaver())
+    reviews = ReviewStore("reviews.sqlite")
+    graph = build_graph(durable_checkpointer(reviews.path))
 
 
     # plot the graph as a nice png
     with open("state_graph.png", "wb") as f:
         f.write(graph.get_graph().draw_mermaid_png())
 
+    # the checkpoints outlive this process, so every run uses fresh thread
+    # ids instead of continuing the threads of the last run
+    run = uuid.uuid4().hex[:8]
 
-    config = {"configurable": {"thread_id": "1"}}
+    config = {"configurable": {"thread_id": f"{run}-1"}}
 
     # run graph as full chatbot - as before
     # while True:
@@ -210,7 +266,7 @@ def main():
     initial_input = {"messages": [{"role": "user", "content": "hi!"}]}
 
     # Thread
-    thread = {"configurable": {"thread_id": "1"}}
+    thread = {"configurable": {"thread_id": f"{run}-1"}}
 
     # Run the graph until the first interruption
     for event in graph.stream(initial_input, thread, stream_mode="updates"):
@@ -221,7 +277,7 @@ def main():
     initial_input = {"messages": [{"role": "user", "content": "what's the weather in Paris?"}]}
 
     
-    thread = {"configurable": {"thread_id": "2"}}
+    thread = {"configurable": {"thread_id": f"{run}-2"}}
     graph_run = graph.stream(initial_input, thread, stream_mode="updates")
 
     print("\n>> Running the graph until the first interruption")
@@ -231,15 +287,51 @@ def main():
     print("\n>> There are pending executions!")
     print(print(f"- {graph.get_state(thread).next}"))
 
+    # index the pending review, so any worker can find and resume it
+    reviews.record(graph, f"{run}-2")
+    print(f"\n>> {reviews.queue_depth()} reviews waiting:")
+    for review in reviews.list_waiting():
+        print(f"- thread {review['thread_id']}: {review['tool_call']}")
+
     # simulate a human saying "yes, that's correct, continue"
-    graph_run_follow_up = graph.stream( Command(resume={"action": "continue"}), thread, stream_mode="updates")
+    # (this could also happen in another process, see review_store.py)
+    graph_run_follow_up = reviews.resume(graph, f"{run}-2", {"action": "continue"})
     
     # alternative: could also simulate a human saying "no, that's not correct, update"
-    # graph_run_follow_up = graph.stream( Command(resume={"action": "update", "data": {"city": "Berlin"}}), thread, stream_mode="updates")
+    # graph_run_follow_up = reviews.resume(graph, f"{run}-2", {"action": "update", "data": {"city": "Berlin"}})
     
     print("\n>> Running the graph until the next interruption")
     for event in graph_run_follow_up:
         print(f"- {event}")
+
+
+    # Example: bulk review - several threads wait for a review at once
+    print("\n--- Bulk review of many pending tool calls -----------------------------")
+    for n, city in [(3, "Berlin"), (4, "Rome"), (5, "Madrid"), (6, "Vienna")]:
+        thread_id = f"{run}-{n}"
+        for event in graph.stream(
+            {"messages": [{"role": "user", "content": f"what's the weather in {city}?"}]},
+            {"configurable": {"thread_id": thread_id}},
+            stream_mode="updates",
+        ):
+            pass
+        reviews.record(graph, thread_id)
+
+    # only the reviews of this run (the file may hold older ones)
+    waiting = [review for review in reviews.list_waiting()
+               if review["thread_id"].startswith(f"{run}-")]
+    print(f"\n>> {len(waiting)} reviews of this run waiting:")
+    for review in waiting:
+        print(f"- thread {review['thread_id']}: {review['tool_call']}")
+
+    # approve all of them (decisions can differ per thread), the threads are
+    # resumed concurrently on a bounded worker pool
+    batch = reviews.resume_batch(
+        graph,
+        {review["thread_id"]: {"action": "continue"} for review in waiting},
+        max_workers=4,
+    )
+    print(f"\n>> Batch resumed: {batch['stats']}")
     
     
 if __name__ == "__main__":
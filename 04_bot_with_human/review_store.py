@@ -0,0 +1,325 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.types import Command
+
+# shared helpers live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.serde import get_serde
+
+
+# Durable human review sessions -------------------------------------------
+#
+# With a MemorySaver, a run that stopped at the interrupt() in
+# human_review_node only lives inside the process that started it. Here both
+# the graph checkpoints (SqliteSaver) and an index of pending reviews live in
+# one local SQLite file, so
+#
+# * waiting threads can be listed quickly (index on status)
+# * any worker process can resume a thread after a restart
+# * the pending-queue depth can be measured with a single COUNT query
+#
+# A thread is claimed (status "waiting" -> "resuming") before it is resumed,
+# so two workers never resume the same review twice. A resume that fails
+# before the graph got past the review puts the thread back to "waiting";
+# one that fails later (e.g. in the tool) marks it "failed", so the decision
+# is not applied a second time.
+#
+# Bulk review: a reviewer who approves hundreds of weather tool calls does not
+# want hundreds of sequential graph runs. resume_batch() takes a batch of
+# decisions and resumes the threads on a bounded thread pool (the runs wait
+# on the model and the checkpointer, so threads are enough), and reports the
+# throughput of the batch.
+
+WAITING = "waiting"
+RESUMING = "resuming"
+DONE = "done"
+FAILED = "failed"
+
+REVIEW_NODE = "human_review_node"
+
+# decisions understood by human_review_node; all but "continue" need "data"
+ACTIONS = ("continue", "update", "feedback")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    # WAL lets several worker processes read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# checkpointer that stores the graph state in the same SQLite file;
+# serde="msgpack" writes messages in the compact format of utils/serde.py,
+# serde="default" uses LangGraph's JsonPlusSerializer
+def durable_checkpointer(path: str = "reviews.sqlite", serde: str = "msgpack") -> SqliteSaver:
+    return SqliteSaver(_connect(path), serde=get_serde(serde))
+
+
+# the same for graphs run with ainvoke()/astream() - SqliteSaver has no async
+# methods. Use it on the event loop that runs the graph:
+#   async with adurable_checkpointer() as checkpointer:
+#       graph = build_graph(checkpointer)
+# ReviewStore itself stays synchronous: call record()/resume() on such a
+# graph from a worker thread (e.g. asyncio.to_thread), not on the loop.
+@asynccontextmanager
+async def adurable_checkpointer(path: str = "reviews.sqlite", serde: str = "msgpack"):
+    async with aiosqlite.connect(path, timeout=30) as conn:
+        yield AsyncSqliteSaver(conn, serde=get_serde(serde))
+
+
+# where a failed resume leaves a review: back in the queue if the graph still
+# stops at it, "failed" if it got further; None (stays "resuming", see
+# requeue_stale()) if the state cannot be read
+def _status_after_error(graph, config: dict):
+    try:
+        next_nodes = graph.get_state(config).next
+    except Exception:
+        return None
+    return WAITING if REVIEW_NODE in next_nodes else FAILED
+
+
+class ReviewStore:
+
+    def __init__(self, path: str = "reviews.sqlite") -> None:
+        self.path = path
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS pending_reviews (
+                    thread_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    tool_call TEXT,
+                    payload TEXT,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pending_reviews_by_status
+                    ON pending_reviews (status, created_at);
+                """
+            )
+
+    # look at the checkpointed state of a thread and index it:
+    # paused at human_review_node -> "waiting", otherwise -> "done"
+    def record(self, graph, thread_id: str) -> str:
+        config = {"configurable": {"thread_id": thread_id}}
+        snapshot = graph.get_state(config)
+        pending = [
+            interrupt.value
+            for task in snapshot.tasks
+            if task.name == REVIEW_NODE
+            for interrupt in task.interrupts
+        ]
+        now = time.time()
+        status = WAITING if pending else DONE
+        payload = pending[-1] if pending else None
+        tool_call = payload.get("tool_call") if isinstance(payload, dict) else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO pending_reviews
+                    (thread_id, status, tool_call, payload, worker, created_at, updated_at)
+                VALUES (?, ?, ?, ?, NULL, ?, ?)
+                ON CONFLICT (thread_id) DO UPDATE SET
+                    status = excluded.status,
+                    tool_call = excluded.tool_call,
+                    payload = excluded.payload,
+                    worker = NULL,
+                    updated_at = excluded.updated_at
+                """,
+                (thread_id, status, json.dumps(tool_call, default=str), json.dumps(payload, default=str), now, now),
+            )
+        return status
+
+    # oldest waiting reviews first
+    def list_waiting(self, limit: int = 100) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT thread_id, tool_call, created_at FROM pending_reviews
+                WHERE status = ? ORDER BY created_at LIMIT ?
+                """,
+                (WAITING, limit),
+            ).fetchall()
+        return [
+            {"thread_id": thread_id, "tool_call": json.loads(tool_call), "created_at": created_at}
+            for thread_id, tool_call, created_at in rows
+        ]
+
+    # index the threads of the checkpoints in the same file that were never
+    # recorded (e.g. started by another script); returns how many of them wait
+    def record_new(self, graph) -> int:
+        with self._lock:
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT DISTINCT thread_id FROM checkpoints
+                    WHERE thread_id NOT IN (SELECT thread_id FROM pending_reviews)
+                    """
+                ).fetchall()
+            except sqlite3.OperationalError:  # no checkpoints written yet
+                return 0
+        return sum(self.record(graph, thread_id) == WAITING for (thread_id,) in rows)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM pending_reviews WHERE status = ?", (WAITING,)
+            ).fetchone()
+        return count
+
+    # atomically move a review from "waiting" to "resuming" for this worker
+    def claim(self, thread_id: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """
+                UPDATE pending_reviews SET status = ?, worker = ?, updated_at = ?
+                WHERE thread_id = ? AND status = ?
+                """,
+                (RESUMING, self.worker, time.time(), thread_id, WAITING),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, thread_id: str, status: str = WAITING) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pending_reviews SET status = ?, worker = NULL, updated_at = ? "
+                "WHERE thread_id = ? AND status = ?",
+                (status, time.time(), thread_id, RESUMING),
+            )
+
+    # hand a stuck "resuming" review back to the queue, e.g. after the worker
+    # that claimed it crashed
+    def requeue_stale(self, older_than: float = 600.0) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE pending_reviews SET status = ?, worker = NULL "
+                "WHERE status = ? AND updated_at < ?",
+                (WAITING, RESUMING, time.time() - older_than),
+            )
+        return cursor.rowcount
+
+    # resume a waiting thread with the human decision, e.g.
+    # {"action": "continue"} - works from any process that shares the file
+    def resume(self, graph, thread_id: str, decision: dict, stream_mode="updates"):
+        if not self.claim(thread_id):
+            raise ValueError(f"Thread {thread_id!r} is not waiting for a review")
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            events = list(graph.stream(Command(resume=decision), config, stream_mode=stream_mode))
+        except BaseException:
+            status = _status_after_error(graph, config)
+            if status is not None:
+                self.release(thread_id, status)
+            raise
+        # the resumed run may have stopped at the next review already
+        self.record(graph, thread_id)
+        return events
+
+    # resume many waiting threads at once: `decisions` maps thread_id ->
+    # decision (as for resume()), at most `max_workers` run concurrently.
+    # Threads that fail (or were not waiting) end up in "errors" and keep
+    # their place in the queue.
+    def resume_batch(self, graph, decisions: dict, max_workers: int = 8,
+                     stream_mode="updates") -> dict:
+        for thread_id, decision in decisions.items():
+            action = decision.get("action")
+            if action not in ACTIONS or (action != "continue" and "data" not in decision):
+                raise ValueError(f"Invalid decision for thread {thread_id!r}: {decision}")
+        events, errors = {}, {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers, thread_name_prefix="review-resume") as pool:
+            futures = {
+                pool.submit(self.resume, graph, thread_id, decision, stream_mode): thread_id
+                for thread_id, decision in decisions.items()
+            }
+            for future in as_completed(futures):
+                thread_id = futures[future]
+                try:
+                    events[thread_id] = future.result()
+                except Exception as error:
+                    errors[thread_id] = error
+        seconds = time.perf_counter() - start
+        return {
+            "events": events,
+            "errors": errors,
+            "stats": {
+                "resumed": len(events),
+                "failed": len(errors),
+                "seconds": seconds,
+                "threads_per_second": len(events) / seconds if seconds else 0.0,
+            },
+        }
+
+    # the same decision for every waiting review, in batches of `batch_size`;
+    # yields the result of each batch. Each thread is resumed at most once -
+    # one that stops at its next review right away stays in the queue.
+    def resume_all(self, graph, decision: dict, batch_size: int = 100, max_workers: int = 8):
+        seen = set()
+        while True:
+            waiting = [
+                review["thread_id"]
+                for review in self.list_waiting(limit=batch_size + len(seen))
+                if review["thread_id"] not in seen
+            ][:batch_size]
+            if not waiting:
+                return
+            seen.update(waiting)
+            yield self.resume_batch(
+                graph, {thread_id: decision for thread_id in waiting}, max_workers
+            )
+
+
+def _decision(args: list) -> dict:
+    action = args[0] if args else "continue"
+    decision = {"action": action}
+    if len(args) > 1:
+        data = " ".join(args[1:])
+        # "update" expects new tool arguments, e.g. '{"city": "Berlin"}'
+        decision["data"] = json.loads(data) if action == "update" else data
+    return decision
+
+
+# Small command line tool to inspect the queue from any process:
+#   python review_store.py            -> queue depth + waiting threads
+#   python review_store.py resume <thread_id> [continue|update <json>|feedback <text>]
+#   python review_store.py resume-all [continue|update <json>|feedback <text>]
+#                                     -> same decision for all waiting threads
+if __name__ == "__main__":
+    import sys
+
+    store = ReviewStore()
+    if len(sys.argv) > 2 and sys.argv[1] == "resume":
+        from bot_with_human import build_graph
+
+        graph = build_graph(durable_checkpointer(store.path))
+        for event in store.resume(graph, sys.argv[2], _decision(sys.argv[3:])):
+            print(f"- {event}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "resume-all":
+        from bot_with_human import build_graph
+
+        graph = build_graph(durable_checkpointer(store.path))
+        store.record_new(graph)
+        for batch in store.resume_all(graph, _decision(sys.argv[2:])):
+            print(f"- batch: {batch['stats']}")
+            for thread_id, error in batch["errors"].items():
+                print(f"  ! thread {thread_id}: {error!r}")
+        print(f">> {store.queue_depth()} reviews waiting")
+    else:
+        print(f">> {store.queue_depth()} reviews waiting")
+        for review in store.list_waiting():
+            print(f"- thread {review['thread_id']}: {review['tool_call']}")
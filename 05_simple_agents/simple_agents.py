@@ -4,10 +4,15 @@ from typing_extensions import Literal
 
 from langchain_core.messages import ToolMessage
 from langchain_core.tools import tool
-from langchain_anthropic import ChatAnthropic
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import MessagesState, StateGraph, START
 from langgraph.types import Command
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.cascade import confident, default_cascade, valid_tool_calls
+
 
 
 # setup environment ----------------------------------------------
@@ -25,8 +30,13 @@ _set_env("ANTHROPIC_API_KEY", file_name="../anthropic_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-# model = ChatAnthropic(model="claude-3-5-sonnet-20240620") # slow, expensive, most accurate
-model = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
+# from utils.clients import get_chat_model
+# model = get_chat_model("claude-3-5-sonnet-20240620") # slow, expensive, most accurate
+# model = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
+
+# haiku first; if its hand-off tool call is malformed or the answer hedges,
+# the advisor asks sonnet instead (utils/cascade.py)
+model = default_cascade()
 
 
 @tool
@@ -43,15 +53,28 @@ def transfer_to_hotel_advisor():
     return
 
 
-def travel_advisor(
-    state: MessagesState,
-) -> Command[Literal["hotel_advisor", "__end__"]]:
-    system_prompt = (
-        "You are a general travel expert that can recommend travel destinations (e.g. countries, cities, etc). "
-        "If you need hotel recommendations, ask 'hotel_advisor' for help."
-    )
-    messages = [{"role": "system", "content": system_prompt}] + state["messages"]
-    ai_msg = model.bind_tools([transfer_to_hotel_advisor]).invoke(messages)
+TRAVEL_ADVISOR_PROMPT = {
+    "role": "system",
+    "content": "You are a general travel expert that can recommend travel destinations (e.g. countries, cities, etc). "
+               "If you need hotel recommendations, ask 'hotel_advisor' for help.",
+}
+HOTEL_ADVISOR_PROMPT = {
+    "role": "system",
+    "content": "You are a hotel expert that can provide hotel recommendations for a given destination. "
+               "If you need help picking travel destinations, ask 'travel_advisor' for help.",
+}
+travel_advisor_model = model.bind_tools(
+    [transfer_to_hotel_advisor],
+    checks=[valid_tool_calls([transfer_to_hotel_advisor]), confident()],
+)
+hotel_advisor_model = model.bind_tools(
+    [transfer_to_travel_advisor],
+    checks=[valid_tool_calls([transfer_to_travel_advisor]), confident()],
+)
+
+
+# shared by the sync and async variant of each advisor below
+def advisor_reply(ai_msg, goto):
     # If there are tool calls, the LLM needs to hand off to another agent
     if len(ai_msg.tool_calls) > 0:
         tool_call_id = ai_msg.tool_calls[-1]["id"]
@@ -62,35 +85,39 @@ def travel_advisor(
             "content": "Successfully transferred",
             "tool_call_id": tool_call_id,
         }
-        return Command(goto="hotel_advisor", update={"messages": [ai_msg, tool_msg]})
+        return Command(goto=goto, update={"messages": [ai_msg, tool_msg]})
 
     # If the expert has an answer, return it directly to the user
     return {"messages": [ai_msg]}
 
 
+def travel_advisor(
+    state: MessagesState,
+) -> Command[Literal["hotel_advisor", "__end__"]]:
+    ai_msg = travel_advisor_model.invoke([TRAVEL_ADVISOR_PROMPT] + state["messages"])
+    return advisor_reply(ai_msg, goto="hotel_advisor")
+
+
 def hotel_advisor(
     state: MessagesState,
 ) -> Command[Literal["travel_advisor", "__end__"]]:
-    system_prompt = (
-        "You are a hotel expert that can provide hotel recommendations for a given destination. "
-        "If you need help picking travel destinations, ask 'travel_advisor' for help."
-    )
-    messages = [{"role": "system", "content": system_prompt}] + state["messages"]
-    ai_msg = model.bind_tools([transfer_to_travel_advisor]).invoke(messages)
-    # If there are tool calls, the LLM needs to hand off to another agent
-    if len(ai_msg.tool_calls) > 0:
-        tool_call_id = ai_msg.tool_calls[-1]["id"]
-        # NOTE: it's important to insert a tool message here because LLM providers are expecting
-        # all AI messages to be followed by a corresponding tool result message
-        tool_msg = {
-            "role": "tool",
-            "content": "Successfully transferred",
-            "tool_call_id": tool_call_id,
-        }
-        return Command(goto="travel_advisor", update={"messages": [ai_msg, tool_msg]})
+    ai_msg = hotel_advisor_model.invoke([HOTEL_ADVISOR_PROMPT] + state["messages"])
+    return advisor_reply(ai_msg, goto="travel_advisor")
+
+
+# async variants of both advisors, used by ainvoke() / astream()
+async def atravel_advisor(
+    state: MessagesState,
+) -> Command[Literal["hotel_advisor", "__end__"]]:
+    ai_msg = await travel_advisor_model.ainvoke([TRAVEL_ADVISOR_PROMPT] + state["messages"])
+    return advisor_reply(ai_msg, goto="hotel_advisor")
 
-    # If the expert has an answer, return it directly to the user
-    return {"messages": [ai_msg]}
+
+async def ahotel_advisor(
+    state: MessagesState,
+) -> Command[Literal["travel_advisor", "__end__"]]:
+    ai_msg = await hotel_advisor_model.ainvoke([HOTEL_ADVISOR_PROMPT] + state["messages"])
+    return advisor_reply(ai_msg, goto="travel_advisor")
 
 # for outpt - as before
 def stream_graph_updates(graph, config, user_input):
@@ -106,9 +133,21 @@ def stream_graph_updates(graph, config, user_input):
     for event in events:
         event["messages"][-1].pretty_print()
 
+# async version of the helper above, for running the graph on an event loop
+async def astream_graph_updates(graph, config, user_input):
+    events = graph.astream(
+        {"messages": [{"role": "user", "content": user_input}]},
+        config,
+        stream_mode="values",
+    )
+    async for event in events:
+        event["messages"][-1].pretty_print()
+
 builder = StateGraph(MessagesState)
-builder.add_node("travel_advisor", travel_advisor)
-builder.add_node("hotel_advisor", hotel_advisor)
+# wrapping both variants lets the graph pick the sync node for
+# invoke()/stream() and the async node for ainvoke()/astream()
+builder.add_node("travel_advisor", RunnableLambda(travel_advisor, afunc=atravel_advisor))
+builder.add_node("hotel_advisor", RunnableLambda(hotel_advisor, afunc=ahotel_advisor))
 
 # we'll always start with a general travel advisor
 builder.add_edge(START, "travel_advisor")
@@ -126,6 +165,7 @@ while True:
     user_input = input("User: ")
     if user_input.lower() in ["quit", "exit", "q"]:
         print("Goodbye!")
+        print("Model tiers:", model.stats.report())
         break
     else:
         stream_graph_updates(graph, config, user_input)
\ No newline at end of file
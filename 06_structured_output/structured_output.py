@@ -1,5 +1,4 @@
 # First we initialize the model we want to use.
-from langchain_anthropic import ChatAnthropic
 import getpass
 import os
 
@@ -8,6 +7,11 @@ from langchain_core.tools import tool
 from pydantic import BaseModel, Field
 from langgraph.prebuilt import create_react_agent
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.clients import get_chat_model
+
 # setup environment ----------------------------------------------
 
 def _set_env(var: str, file_name):
@@ -22,7 +26,7 @@ _set_env("ANTHROPIC_API_KEY", file_name="../anthropic_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-model = ChatAnthropic(model="claude-3-haiku-20240307") # fast, cheap, less accurate
+model = get_chat_model("claude-3-haiku-20240307") # fast, cheap, less accurate
 
 
 @tool
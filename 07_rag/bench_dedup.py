@@ -0,0 +1,94 @@
+import random
+import re
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from bench_splitter import make_corpus
+from dedup import NearDuplicateFilter
+from fast_splitter import FastRecursiveCharacterTextSplitter
+from vector_store import BatchInMemoryVectorStore
+
+
+# Benchmark: near-duplicate elimination at ingest ------------------------------
+#
+# The synthetic corpus of bench_splitter.py (without its "xxx..." filler
+# tokens, which are exact duplicates of each other) plus re-crawled copies of
+# a part of its documents (same page under another URL, a few words changed). The
+# corpus is split with the settings of rag_adv.py and indexed twice - as is
+# and through NearDuplicateFilter - and we report
+#
+# * chunks and vector index size with and without dedup
+# * how many chunks of the re-crawled copies were dropped, and how many
+#   chunks of distinct documents were dropped by mistake
+# * throughput of the dedup stage and of the whole ingest (split, dedup,
+#   embed, index)
+#
+# Run it from this folder: python bench_dedup.py
+
+N_DOCUMENTS = 100
+RECRAWLED = 0.3   # share of documents that appear a second time
+EDIT_RATE = 0.01  # share of words changed in a re-crawled copy
+THRESHOLD = 0.8
+
+
+def recrawl(document: Document, rng: random.Random) -> Document:
+    words = document.page_content.split(" ")
+    for i in rng.sample(range(len(words)), int(len(words) * EDIT_RATE)):
+        words[i] = rng.choice(["agents", "memories", "plan", "tools", "an", "on"])
+    return Document(page_content=" ".join(words),
+                    metadata={"source": document.metadata["source"] + "?recrawl=1"})
+
+
+def ingest(documents: list, dedup=None):
+    start = time.perf_counter()
+    splitter = FastRecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    splits = splitter.split_documents(documents)
+    if dedup is not None:
+        splits = dedup.filter(splits)
+    store = BatchInMemoryVectorStore(DeterministicFakeEmbedding(size=4096))
+    store.add_documents(splits)
+    return store, splits, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    originals = [
+        Document(page_content=re.sub(r" x{1000,}", "", document.page_content),
+                 metadata=document.metadata)
+        for document in make_corpus(N_DOCUMENTS)
+    ]
+    copies = [recrawl(document, rng) for document in rng.sample(originals, int(N_DOCUMENTS * RECRAWLED))]
+    corpus = originals + copies
+    print(f">> {len(originals)} documents + {len(copies)} re-crawled copies, "
+          f"{sum(len(d.page_content) for d in corpus):,} characters\n")
+
+    store, splits, plain_time = ingest(corpus)
+    dedup = NearDuplicateFilter(threshold=THRESHOLD)
+    deduped_store, kept, dedup_time = ingest(corpus, dedup)
+
+    plain_bytes = store.memory_usage()["index_bytes"]
+    deduped_bytes = deduped_store.memory_usage()["index_bytes"]
+    report = dedup.report()
+    copy_chunks = sum("recrawl" in d.metadata["source"] for d in splits)
+    dropped_copies = copy_chunks - sum("recrawl" in d.metadata["source"] for d in kept)
+    dropped_originals = report["dropped"] - dropped_copies
+
+    print(f"{'':10} {'chunks':>8} {'index MB':>9} {'ingest s':>9} {'chunks/s':>9}")
+    print(f"{'plain':10} {len(splits):8,} {plain_bytes / 1e6:9.1f} {plain_time:9.2f} "
+          f"{len(splits) / plain_time:9,.0f}")
+    print(f"{'dedup':10} {len(kept):8,} {deduped_bytes / 1e6:9.1f} {dedup_time:9.2f} "
+          f"{len(splits) / dedup_time:9,.0f}")
+    print(f"\n>> index size -{1 - deduped_bytes / plain_bytes:.0%}, "
+          f"dedup stage {report['docs_per_second']:,.0f} chunks/s "
+          f"({report['seconds'] * 1000:.0f} ms, threshold {THRESHOLD}, "
+          f"{dedup.bands} bands x {dedup.rows} rows)")
+    print(f">> chunks of re-crawled copies dropped: {dropped_copies}/{copy_chunks}, "
+          f"distinct chunks dropped: {dropped_originals}")
+    print(f">> ingest with the filter is {dedup_time / plain_time - 1:+.0%} "
+          f"({dedup_time:.2f} s vs {plain_time:.2f} s): with the fake embeddings the "
+          f"stage costs more than the dropped chunks save")
+    example = next(d for d in kept if "duplicates" in d.metadata)
+    print(f">> provenance of a kept chunk: source {example.metadata['source']}, "
+          f"duplicates {example.metadata['duplicates']}")
@@ -0,0 +1,112 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from vector_store import BatchInMemoryVectorStore
+
+
+# Benchmark: memory and recall of the vector storage formats -----------------
+#
+# Synthetic 4096-dim embeddings (like DeterministicFakeEmbedding(size=4096)),
+# but clustered, so that nearest neighbours are meaningful: every chunk is a
+# topic vector plus noise, and queries are noisy copies of random chunks.
+# For every storage format we report
+#
+# * bytes per chunk and the extrapolated memory for one million chunks
+# * recall@k against the exact float32 search
+# * queries per second for a batch of queries
+#
+# Run it from this folder: python bench_quantization.py
+
+DIM = 4096
+N_CHUNKS = 5000
+N_TOPICS = 100
+N_QUERIES = 200
+K = 4
+
+MODES = [
+    ("float32", {}),
+    ("float16", {}),
+    ("int8", {}),
+    ("int8", {"rerank": 4}),
+    ("pq", {}),
+    ("pq", {"rerank": 10}),
+    ("pq", {"rerank": 10, "rerank_path": "disk"}),
+]
+
+
+# looks up precomputed vectors instead of computing embeddings
+class LookupEmbedding(Embeddings):
+
+    def __init__(self, vectors: dict) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def make_data(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((N_TOPICS, DIM))
+    chunks = topics[rng.integers(N_TOPICS, size=N_CHUNKS)] + rng.standard_normal((N_CHUNKS, DIM))
+    queries = chunks[rng.integers(N_CHUNKS, size=N_QUERIES)] + 0.5 * rng.standard_normal((N_QUERIES, DIM))
+    vectors = {f"chunk {i}": v.tolist() for i, v in enumerate(chunks)}
+    vectors.update({f"query {i}": v.tolist() for i, v in enumerate(queries)})
+    return vectors
+
+
+def python_list_bytes(vector: list) -> int:
+    return sys.getsizeof(vector) + sum(sys.getsizeof(x) for x in vector)
+
+
+if __name__ == "__main__":
+    vectors = make_data()
+    embeddings = LookupEmbedding(vectors)
+    docs = [Document(page_content=f"chunk {i}") for i in range(N_CHUNKS)]
+    queries = [f"query {i}" for i in range(N_QUERIES)]
+
+    list_bytes = python_list_bytes(vectors["chunk 0"])
+    print(f">> {N_CHUNKS} chunks, {DIM} dims, recall@{K} over {N_QUERIES} queries")
+    print(f">> InMemoryVectorStore keeps a list of Python floats: {list_bytes / 1024:,.0f} KB per chunk, "
+          f"{list_bytes * 1e6 / 1e9:,.0f} GB per million chunks\n")
+
+    exact = None
+    tmp_dir = tempfile.mkdtemp()
+    print(f"{'storage':26} {'RAM bytes/chunk':>15} {'RAM GB / 1M':>12} {'disk GB / 1M':>13} "
+          f"{'recall@' + str(K):>9} {'queries/sec':>12}")
+    for storage, options in MODES:
+        if options.get("rerank_path"):
+            options = {**options, "rerank_path": os.path.join(tmp_dir, "rerank.f32")}
+        store = BatchInMemoryVectorStore(embeddings, storage=storage, **options)
+        store.add_documents(docs)
+        usage = store.memory_usage()  # also builds the index
+
+        start = time.perf_counter()
+        results = store.batch_similarity_search(queries, k=K)
+        elapsed = time.perf_counter() - start
+
+        found = [{doc.page_content for doc in result} for result in results]
+        if exact is None:
+            exact = found
+        recall = np.mean([len(f & e) / K for f, e in zip(found, exact)])
+
+        per_chunk = (usage["index_bytes"] + usage["rerank_bytes"]) / usage["documents"]
+        disk_per_chunk = usage["rerank_disk_bytes"] / usage["documents"]
+        name = storage
+        if "rerank" in options:
+            name += f" +rerank x{options['rerank']}"
+            name += " (mmap)" if "rerank_path" in options else ""
+        print(f"{name:26} {per_chunk:15,.0f} {per_chunk * 1e6 / 1e9:12.2f} {disk_per_chunk * 1e6 / 1e9:13.2f} "
+              f"{recall:9.3f} {N_QUERIES / elapsed:12,.0f}")
+
+    print("\n(pq bytes include the shared codebooks; rerank keeps a float32 copy for the re-scoring,")
+    print(" either in memory or in a memory-mapped file)")
@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from sharded_store import ShardedVectorStore
+from vector_store import BatchInMemoryVectorStore
+
+
+# Benchmark: search throughput vs. number of shards -------------------------
+#
+# Indexes a synthetic corpus into a ShardedVectorStore with 1, 2, 4, ...
+# worker processes and measures queries/sec for several concurrent clients
+# that send batches of queries. A single-process BatchInMemoryVectorStore is
+# the baseline. Afterwards it shows what happens with a slow and a dead shard.
+#
+# Run it from this folder: python bench_sharding.py
+
+DIM = 1024
+N_CHUNKS = 20_000
+N_CLIENTS = 4
+BATCHES_PER_CLIENT = 10
+QUERIES_PER_BATCH = 16
+SHARD_COUNTS = [1, 2, 4]
+
+
+def make_corpus():
+    sections = ("beginning", "middle", "end")
+    return [
+        Document(page_content=f"synthetic chunk {i}", metadata={"section": sections[i % 3]})
+        for i in range(N_CHUNKS)
+    ]
+
+
+def throughput(store, embeddings) -> float:
+    batches = [
+        embeddings.embed_documents([f"question {c}-{b}-{q}" for q in range(QUERIES_PER_BATCH)])
+        for c in range(N_CLIENTS)
+        for b in range(BATCHES_PER_CLIENT)
+    ]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(N_CLIENTS) as clients:
+        list(clients.map(
+            lambda batch: store.batch_similarity_search_with_score_by_vector(batch, 4, {"section": "end"}),
+            batches,
+        ))
+    return len(batches) * QUERIES_PER_BATCH / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    embeddings = DeterministicFakeEmbedding(size=DIM)
+    docs = make_corpus()
+    print(f">> {N_CHUNKS:,} chunks, {DIM} dims, {N_CLIENTS} clients, {os.cpu_count()} CPU cores\n")
+
+    single = BatchInMemoryVectorStore(embeddings)
+    single.add_documents(docs)
+    print(f"{'single process':16} {throughput(single, embeddings):10,.0f} queries/sec")
+
+    for n_shards in SHARD_COUNTS:
+        store = ShardedVectorStore(embeddings, n_shards=n_shards, timeout=30.0)
+        store.add_documents(docs)
+        print(f"{f'{n_shards} shard(s)':16} {throughput(store, embeddings):10,.0f} queries/sec")
+        if n_shards != SHARD_COUNTS[-1]:
+            store.close()
+
+    # one slow shard: the search returns the other shards' hits after the timeout
+    store.timeout = 0.5
+    store.shards[0].submit("sleep", 2.0)
+    start = time.perf_counter()
+    hits = store.similarity_search("question", k=4)
+    print(f"\n>> slow shard: {len(hits)} hits after {time.perf_counter() - start:.2f}s, stats: {store.stats}")
+
+    # one dead shard: it is skipped right away
+    store.shards[1].process.terminate()
+    store.shards[1].process.join()
+    time.sleep(0.1)  # let the shard notice that its process is gone
+    start = time.perf_counter()
+    hits = store.similarity_search("question", k=4)
+    print(f">> dead shard: {len(hits)} hits after {time.perf_counter() - start:.2f}s, stats: {store.stats}")
+    store.close()
@@ -0,0 +1,82 @@
+import random
+import time
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from fast_splitter import FastRecursiveCharacterTextSplitter
+
+
+# Benchmark: FastRecursiveCharacterTextSplitter vs. the original -------------
+#
+# Builds a synthetic document dump (paragraphs, line breaks, a few very long
+# "words" that force the character-level fallback), splits it with both
+# splitters using the settings from rag_simple.py / rag_adv.py and
+#
+# * checks that both produce the same chunks and metadata
+# * prints the throughput in chunks per second
+#
+# Run it from this folder: python bench_splitter.py
+
+N_DOCUMENTS = 200
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def make_corpus(n_documents: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    words = [
+        "agent", "memory", "planning", "tool", "reflection", "task",
+        "decomposition", "LLM", "prompt", "retrieval", "vector", "the",
+        "a", "of", "and", "to", "in", "is", "with", "for",
+    ]
+    documents = []
+    for doc_id in range(n_documents):
+        paragraphs = []
+        for _ in range(rng.randint(20, 60)):
+            lines = []
+            for _ in range(rng.randint(1, 6)):
+                n_words = rng.randint(5, 80)
+                line = " ".join(rng.choice(words) for _ in range(n_words))
+                if rng.random() < 0.02:
+                    # a very long token without any separator
+                    line += " " + "x" * rng.randint(1000, 2500)
+                lines.append(line)
+            paragraphs.append("\n".join(lines))
+        text = "\n\n".join(paragraphs)
+        documents.append(Document(page_content=text, metadata={"source": f"doc-{doc_id}"}))
+    return documents
+
+
+def timed(splitter, documents):
+    start = time.perf_counter()
+    splits = splitter.split_documents(documents)
+    return splits, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    docs = make_corpus(N_DOCUMENTS)
+    print(f">> Corpus: {len(docs)} documents, {sum(len(d.page_content) for d in docs):,} characters")
+
+    original = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
+    )
+    fast_serial = FastRecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, max_workers=1
+    )
+    fast_parallel = FastRecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, min_chars_per_worker=1
+    )
+
+    reference, reference_time = timed(original, docs)
+    print(f">> original:        {len(reference) / reference_time:10,.0f} chunks/sec")
+
+    for name, splitter in [("fast (1 core)", fast_serial), ("fast (parallel)", fast_parallel)]:
+        splits, elapsed = timed(splitter, docs)
+        same_chunks = [d.page_content for d in splits] == [d.page_content for d in reference]
+        same_metadata = [d.metadata for d in splits] == [d.metadata for d in reference]
+        print(
+            f">> {name + ':':16} {len(splits) / elapsed:10,.0f} chunks/sec "
+            f"({reference_time / elapsed:.1f}x), same chunks: {same_chunks}, "
+            f"same metadata: {same_metadata}"
+        )
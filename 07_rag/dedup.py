@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+# Near-duplicate chunks at ingest (MinHash + LSH) ---------------------------
+#
+# Re-crawled pages, mirrors and boilerplate produce chunks that are almost the
+# same text. They make the index bigger and fill the top-k of a search with
+# the same passage several times. NearDuplicateFilter sits between
+# split_documents() and add_documents() and drops every chunk whose estimated
+# Jaccard similarity (on word shingles) to an already kept chunk is at least
+# `threshold`:
+#
+# * MinHash: every chunk gets a signature of `num_perm` minimum hash values;
+#   the share of equal values estimates the Jaccard similarity of two chunks
+# * LSH: the signature is cut into bands; only chunks that share a band are
+#   compared, so the cost per chunk does not grow with the index
+#
+# Provenance: chunks only count as duplicates if the metadata fields in
+# `keep_apart` are equal (e.g. ("section",), so a section filter still finds
+# its chunks), and the kept chunk lists the metadata of the chunks it
+# replaced in metadata["duplicates"] - only while it is new: a chunk returned
+# by an earlier filter() call may be stored already and is not changed again.
+# Duplicates of those chunks are listed in `earlier_duplicates` instead.
+#
+# Neighbouring chunks of one split (chunk_overlap=200 of 1000) share far less
+# than 80% of their shingles and are kept.
+
+_WORD = re.compile(r"\w+")
+_SHIFT = np.uint64(32)
+
+
+# bands x rows with bands * rows <= num_perm whose S-curve threshold
+# (1 / bands) ** (1 / rows) is closest to the wanted similarity
+def _lsh_bands(threshold: float, num_perm: int):
+    return min(
+        ((bands, num_perm // bands) for bands in range(1, num_perm + 1)),
+        key=lambda band: abs((1 / band[0]) ** (1 / band[1]) - threshold),
+    )
+
+
+def _provenance(document) -> dict:
+    return {key: value for key, value in document.metadata.items() if key != "duplicates"}
+
+
+class NearDuplicateFilter:
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 3,
+                 keep_apart: tuple = (), seed: int = 1) -> None:
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.keep_apart = tuple(keep_apart)
+        self.bands, self.rows = _lsh_bands(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        # multiply-shift hash functions h(x) = ((a * x + b) mod 2**64) >> 32
+        # with odd a (uint64 arithmetic wraps around, no modulo needed)
+        self._a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._mix = rng.integers(0, 1 << 63, size=shingle_size, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._lock = threading.Lock()
+        self._buckets = [{} for _ in range(self.bands)]  # band -> {key: [kept positions]}
+        self._signatures = []  # signature of every kept chunk
+        self._kept = []        # every kept chunk
+        # {"original": metadata, "duplicate": metadata} for chunks that
+        # duplicate a chunk returned by an earlier filter() call
+        self.earlier_duplicates = []
+        self.stats = {"documents": 0, "kept": 0, "dropped": 0,
+                      "chars_in": 0, "chars_kept": 0, "seconds": 0.0}
+
+    # hashes of the word n-grams: one crc32 per word, combined per n-gram
+    def _shingles(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower()) or [""]
+        hashes = np.fromiter((zlib.crc32(word.encode()) for word in words),
+                             dtype=np.uint64, count=len(words))
+        size = min(self.shingle_size, len(hashes))
+        count = len(hashes) - size + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            shingles += hashes[offset:offset + count] * self._mix[offset]
+        return np.unique(shingles)
+
+    def signature(self, text: str) -> np.ndarray:
+        values = (np.outer(self._shingles(text), self._a) + self._b) >> _SHIFT
+        return values.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray, group: tuple) -> list:
+        return [
+            (group, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def similarity(self, a: str, b: str) -> float:
+        """Estimated Jaccard similarity of the shingles of two texts."""
+        return float(np.mean(self.signature(a) == self.signature(b)))
+
+    # the position of the kept chunk this one duplicates, or None
+    def _match(self, signature: np.ndarray, keys: list):
+        candidates = {position for band, key in enumerate(keys)
+                      for position in self._buckets[band].get(key, ())}
+        for position in sorted(candidates):
+            if np.mean(self._signatures[position] == signature) >= self.threshold:
+                return position
+        return None
+
+    def filter(self, documents: list) -> list:
+        """Return copies of the documents that are not near-duplicates of a
+        document seen before (in this call or an earlier one). The documents
+        passed in are not modified."""
+        start = time.perf_counter()
+        kept = []
+        with self._lock:
+            first_new = len(self._kept)
+            for document in documents:
+                signature = self.signature(document.page_content)
+                group = tuple(document.metadata.get(field) for field in self.keep_apart)
+                keys = self._band_keys(signature, group)
+                match = self._match(signature, keys)
+                self.stats["documents"] += 1
+                self.stats["chars_in"] += len(document.page_content)
+                if match is not None:
+                    self.stats["dropped"] += 1
+                    duplicate = _provenance(document)
+                    original = self._kept[match]
+                    if match >= first_new:
+                        # a new list: the copy shares the caller's metadata values
+                        original.metadata["duplicates"] = [
+                            *original.metadata.get("duplicates", []), duplicate
+                        ]
+                    else:
+                        self.earlier_duplicates.append(
+                            {"original": _provenance(original), "duplicate": duplicate}
+                        )
+                    continue
+                position = len(self._kept)
+                for band, key in enumerate(keys):
+                    self._buckets[band].setdefault(key, []).append(position)
+                self._signatures.append(signature)
+                # annotated with its duplicates later, so keep a copy
+                document = document.model_copy(update={"metadata": dict(document.metadata)})
+                self._kept.append(document)
+                kept.append(document)
+                self.stats["kept"] += 1
+                self.stats["chars_kept"] += len(document.page_content)
+            self.stats["seconds"] += time.perf_counter() - start
+        return kept
+
+    def report(self) -> dict:
+        stats = dict(self.stats)
+        stats["reduction"] = stats["dropped"] / stats["documents"] if stats["documents"] else 0.0
+        stats["docs_per_second"] = stats["documents"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
+
+
+# Quick check: python dedup.py -------------------------------------------------
+
+if __name__ == "__main__":
+    dedup = NearDuplicateFilter(threshold=0.8)
+    text = ("Task decomposition can be done by an LLM with simple prompting like steps "
+            "for XYZ, by using task-specific instructions or with human inputs. ") * 4
+    print(f">> bands x rows: {dedup.bands} x {dedup.rows}")
+    print(f">> same text, one word changed: "
+          f"{dedup.similarity(text, text.replace('human', 'manual', 1)):.2f}")
+    print(f">> unrelated text: {dedup.similarity(text, 'Memory can be short-term or long-term.'):.2f}")
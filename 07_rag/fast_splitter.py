@@ -0,0 +1,171 @@
+import copy
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+# Fast drop-in replacement for RecursiveCharacterTextSplitter ---------------
+#
+# The original splitter builds new strings on every recursion level
+# (re.split, piece + separator, "".join(...)) and runs single-threaded.
+# This version produces exactly the same chunks, but
+#
+# * works on (start, end) offsets into the original text and only slices
+#   out the final chunks
+# * records the real start offset of each chunk as `start_index`
+# * splits several documents in parallel on all cores
+#
+# It supports the default setup (plain string separators, keep_separator,
+# length measured in characters). Any other configuration falls back to the
+# original implementation.
+
+
+class FastRecursiveCharacterTextSplitter(RecursiveCharacterTextSplitter):
+
+    def __init__(self, add_start_index: bool = True, max_workers=None,
+                 min_chars_per_worker: int = 200_000, **kwargs) -> None:
+        super().__init__(add_start_index=add_start_index, **kwargs)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        # below this many characters per worker, process start-up costs more
+        # than it saves and the documents are split in this process
+        self._min_chars_per_worker = min_chars_per_worker
+
+    def _is_supported(self) -> bool:
+        return (
+            not self._is_separator_regex
+            and self._keep_separator in (True, "start")
+            and self._length_function is len
+        )
+
+    # pieces of text[start:end] at every occurrence of `separator`, with the
+    # separator kept at the start of the following piece (like the original)
+    @staticmethod
+    def _split_spans(text: str, start: int, end: int, separator: str) -> list:
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        spans = []
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                spans.append((piece_start, position))
+            piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if end > piece_start:
+            spans.append((piece_start, end))
+        return spans
+
+    # same bookkeeping as TextSplitter._merge_splits with an empty separator:
+    # consecutive pieces are merged into chunks of at most chunk_size, and
+    # pieces are kept from the previous chunk as long as they fit the overlap
+    def _merge_spans(self, text: str, spans: list, chunks: list) -> None:
+        current = deque()
+        total = 0
+        for span in spans:
+            length = span[1] - span[0]
+            if total + length > self._chunk_size:
+                if current:
+                    self._add_chunk(text, current[0][0], current[-1][1], chunks)
+                    while total > self._chunk_overlap or (
+                        total + length > self._chunk_size and total > 0
+                    ):
+                        first = current.popleft()
+                        total -= first[1] - first[0]
+            current.append(span)
+            total += length
+        if current:
+            self._add_chunk(text, current[0][0], current[-1][1], chunks)
+
+    def _add_chunk(self, text: str, start: int, end: int, chunks: list) -> None:
+        chunk = text[start:end]
+        if self._strip_whitespace:
+            stripped = chunk.lstrip()
+            start += len(chunk) - len(stripped)
+            chunk = stripped.rstrip()
+        if chunk:
+            chunks.append((start, chunk))
+
+    def _split_span(self, text: str, start: int, end: int, separators: list,
+                    chunks: list) -> None:
+        # first separator that occurs in this part of the text
+        separator = separators[-1]
+        new_separators = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                new_separators = separators[i + 1:]
+                break
+
+        good_spans = []
+        for span in self._split_spans(text, start, end, separator):
+            if span[1] - span[0] < self._chunk_size:
+                good_spans.append(span)
+                continue
+            if good_spans:
+                self._merge_spans(text, good_spans, chunks)
+                good_spans = []
+            if not new_separators:
+                chunks.append((span[0], text[span[0]:span[1]]))
+            else:
+                self._split_span(text, span[0], span[1], new_separators, chunks)
+        if good_spans:
+            self._merge_spans(text, good_spans, chunks)
+
+    # (start_index, chunk) pairs for one text
+    def split_text_with_offsets(self, text: str) -> list:
+        chunks = []
+        self._split_span(text, 0, len(text), self._separators, chunks)
+        return chunks
+
+    def split_text(self, text: str) -> list:
+        if not self._is_supported():
+            return super().split_text(text)
+        return [chunk for _, chunk in self.split_text_with_offsets(text)]
+
+    def _documents_for(self, text: str, metadata: dict) -> list:
+        if not self._is_supported():
+            return super().create_documents([text], [metadata])
+        documents = []
+        for start, chunk in self.split_text_with_offsets(text):
+            chunk_metadata = copy.deepcopy(metadata)
+            if self._add_start_index:
+                chunk_metadata["start_index"] = start
+            documents.append(Document(page_content=chunk, metadata=chunk_metadata))
+        return documents
+
+    def create_documents(self, texts: list, metadatas=None) -> list:
+        metadatas = metadatas or [{}] * len(texts)
+        total_chars = sum(len(text) for text in texts)
+        workers = min(
+            self._max_workers,
+            len(texts),
+            total_chars // self._min_chars_per_worker,
+        )
+        if workers <= 1:
+            return [
+                document
+                for text, metadata in zip(texts, metadatas)
+                for document in self._documents_for(text, metadata)
+            ]
+
+        # each document is split on its own, so they can go to different
+        # processes; map() keeps the original order of the results
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                _split_in_worker,
+                [self] * len(texts),
+                texts,
+                metadatas,
+                chunksize=max(1, len(texts) // (workers * 4)),
+            )
+            return [document for documents in results for document in documents]
+
+
+def _split_in_worker(splitter, text, metadata):
+    return splitter._documents_for(text, metadata)
@@ -0,0 +1,271 @@
+import numpy as np
+
+
+# Storage formats for the embedding vectors --------------------------------
+#
+# All formats store unit-length vectors row by row and compute cosine scores
+# against a batch of (unit-length) queries:
+#
+# * "float32" - 4 bytes per dimension, exact
+# * "float16" - 2 bytes per dimension, tiny rounding error
+# * "int8"    - 1 byte per dimension + one float32 scale per vector
+#               (symmetric scalar quantization per vector)
+# * "pq"      - product quantization: the vector is cut into `n_subvectors`
+#               pieces and each piece is replaced by the id (1 byte) of the
+#               closest of 256 centroids learned with k-means; until
+#               `train_size` vectors were added they are kept as float32
+#               and the codebooks are learned on all of them at once
+#
+# Scores for the compressed formats are computed block by block, so a search
+# never needs a full-precision copy of the whole index.
+
+_BLOCK_ROWS = 8192
+
+
+class Float32Storage:
+
+    dtype = np.float32
+
+    def __init__(self) -> None:
+        self.rows = None
+
+    def __len__(self) -> int:
+        return 0 if self.rows is None else len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.rows is None else self.rows.nbytes
+
+    def append(self, vectors: np.ndarray) -> None:
+        new_rows = vectors.astype(self.dtype)
+        self.rows = new_rows if self.rows is None else np.concatenate([self.rows, new_rows])
+
+    def keep(self, mask: np.ndarray) -> None:
+        self.rows = self.rows[mask]
+
+    def decode(self, index) -> np.ndarray:
+        return self.rows[index].astype(np.float32)
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.rows.dtype == np.float32:
+            return queries @ self.rows.T
+        # convert block by block instead of the whole matrix at once
+        result = np.empty((len(queries), len(self.rows)), dtype=np.float32)
+        for start in range(0, len(self.rows), _BLOCK_ROWS):
+            block = self.rows[start:start + _BLOCK_ROWS].astype(np.float32)
+            result[:, start:start + _BLOCK_ROWS] = queries @ block.T
+        return result
+
+
+# float32 rows in a memory-mapped file: used for the full-precision rerank
+# copy, so that only the few candidate rows that are re-scored are read
+# into memory. The file belongs to this storage: an existing file is not
+# overwritten.
+class DiskFloat32Storage:
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.rows = None
+        self._dim = None
+        try:
+            open(path, "xb").close()
+        except FileExistsError:
+            raise FileExistsError(
+                f"{path} exists already; remove it or choose another rerank_path"
+            ) from None
+
+    def __len__(self) -> int:
+        return 0 if self.rows is None else len(self.rows)
+
+    # nothing of it is kept in RAM
+    nbytes = 0
+
+    @property
+    def disk_bytes(self) -> int:
+        return 0 if self.rows is None else self.rows.nbytes
+
+    def _reopen(self, n_rows: int) -> None:
+        self.rows = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(n_rows, self._dim))
+
+    def append(self, vectors: np.ndarray) -> None:
+        self._dim = vectors.shape[1]
+        self.rows = None  # close the map before the file grows
+        with open(self.path, "ab") as file:
+            file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.path, "rb") as file:
+            file.seek(0, 2)
+            n_rows = file.tell() // (4 * self._dim)
+        self._reopen(n_rows)
+
+    def keep(self, mask: np.ndarray) -> None:
+        kept = np.array(self.rows[mask])
+        self.rows = None
+        with open(self.path, "wb") as file:
+            file.write(kept.tobytes())
+        if len(kept):
+            self._reopen(len(kept))
+
+    def decode(self, index) -> np.ndarray:
+        return np.asarray(self.rows[index], dtype=np.float32)
+
+
+class Float16Storage(Float32Storage):
+
+    dtype = np.float16
+
+
+class Int8Storage:
+
+    def __init__(self) -> None:
+        self.codes = None
+        self.scales = None
+
+    def __len__(self) -> int:
+        return 0 if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.codes is None else self.codes.nbytes + self.scales.nbytes
+
+    def append(self, vectors: np.ndarray) -> None:
+        max_abs = np.abs(vectors).max(axis=1, keepdims=True)
+        max_abs[max_abs == 0] = 1.0
+        scales = (max_abs / 127.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        if self.codes is None:
+            self.codes, self.scales = codes, scales[:, 0]
+        else:
+            self.codes = np.concatenate([self.codes, codes])
+            self.scales = np.concatenate([self.scales, scales[:, 0]])
+
+    def keep(self, mask: np.ndarray) -> None:
+        self.codes, self.scales = self.codes[mask], self.scales[mask]
+
+    def decode(self, index) -> np.ndarray:
+        return self.codes[index].astype(np.float32) * self.scales[index, None]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        result = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS].astype(np.float32)
+            result[:, start:start + _BLOCK_ROWS] = (
+                (queries @ block.T) * self.scales[start:start + _BLOCK_ROWS]
+            )
+        return result
+
+
+class ProductQuantizedStorage:
+
+    def __init__(self, n_subvectors: int = 128, n_centroids: int = 256,
+                 n_iterations: int = 8, train_size: int = 4096, seed: int = 0) -> None:
+        if n_centroids > 256:
+            raise ValueError("n_centroids must fit into one byte (<= 256)")
+        self.n_subvectors = n_subvectors
+        self.n_centroids = n_centroids
+        self.n_iterations = n_iterations
+        self.train_size = train_size
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None  # (n_subvectors, n_centroids, sub_dim)
+        self.codes = None      # (n_rows, n_subvectors) uint8
+        self._untrained = Float32Storage()  # the vectors added before training
+
+    def __len__(self) -> int:
+        return len(self._untrained) if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        if self.codes is None:
+            return self._untrained.nbytes
+        return self.codes.nbytes + self.centroids.nbytes
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        if dim % self.n_subvectors:
+            raise ValueError(
+                f"Embedding size {dim} is not divisible by n_subvectors={self.n_subvectors}"
+            )
+        # (n_subvectors, n, sub_dim)
+        return vectors.reshape(n, self.n_subvectors, -1).transpose(1, 0, 2)
+
+    # k-means per subspace on (a sample of) the first `train_size` vectors
+    def _train(self, vectors: np.ndarray) -> None:
+        if len(vectors) > self.train_size:
+            vectors = vectors[self.rng.choice(len(vectors), self.train_size, replace=False)]
+        pieces = self._split(vectors)
+        n_centroids = min(self.n_centroids, len(vectors))
+        centroids = []
+        for piece in pieces:
+            centers = piece[self.rng.choice(len(piece), n_centroids, replace=False)]
+            for _ in range(self.n_iterations):
+                assignment = _nearest(piece, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assignment, piece)
+                counts = np.bincount(assignment, minlength=n_centroids)[:, None]
+                # empty clusters keep their old center
+                centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+            centroids.append(centers)
+        self.centroids = np.stack(centroids).astype(np.float32)
+
+    def append(self, vectors: np.ndarray) -> None:
+        vectors = vectors.astype(np.float32)
+        pieces = self._split(vectors)
+        if self.centroids is None:
+            self._untrained.append(vectors)
+            if len(self._untrained) < self.train_size:
+                return
+            vectors, self._untrained = self._untrained.rows, Float32Storage()
+            self._train(vectors)
+            pieces = self._split(vectors)
+        codes = np.stack(
+            [_nearest(piece, centers) for piece, centers in zip(pieces, self.centroids)],
+            axis=1,
+        ).astype(np.uint8)
+        self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+
+    def keep(self, mask: np.ndarray) -> None:
+        if self.codes is None:
+            self._untrained.keep(mask)
+        else:
+            self.codes = self.codes[mask]
+
+    def decode(self, index) -> np.ndarray:
+        if self.codes is None:
+            return self._untrained.decode(index)
+        codes = np.atleast_2d(self.codes[index])
+        pieces = [self.centroids[j][codes[:, j]] for j in range(self.n_subvectors)]
+        decoded = np.concatenate(pieces, axis=1)
+        return decoded[0] if np.ndim(index) == 0 else decoded
+
+    # asymmetric distance computation: one lookup table of
+    # query-piece x centroid dot products per query, then sum up lookups
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.codes is None:
+            return self._untrained.scores(queries)
+        query_pieces = self._split(queries.astype(np.float32))
+        result = np.zeros((len(queries), len(self.codes)), dtype=np.float32)
+        for j in range(self.n_subvectors):
+            table = query_pieces[j] @ self.centroids[j].T  # (n_queries, n_centroids)
+            result += table[:, self.codes[:, j]]
+        return result
+
+
+def _nearest(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    # argmin |p - c|^2 = argmin (|c|^2 - 2 p.c)
+    distances = (centers ** 2).sum(axis=1) - 2.0 * points @ centers.T
+    return distances.argmin(axis=1)
+
+
+STORAGE_FORMATS = {
+    "float32": Float32Storage,
+    "float16": Float16Storage,
+    "int8": Int8Storage,
+    "pq": ProductQuantizedStorage,
+}
+
+
+def make_storage(storage: str, **options):
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(
+            f"Unknown storage {storage!r}, choose one of {sorted(STORAGE_FORMATS)}"
+        )
+    return STORAGE_FORMATS[storage](**options)
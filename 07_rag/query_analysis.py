@@ -0,0 +1,185 @@
+import re
+import threading
+from collections import OrderedDict
+
+
+# Query analysis without an LLM round trip on the critical path -------------
+#
+# analyze_query in rag_adv.py turns the question into a search query plus the
+# `section` of the post to search in. That used to be one structured-output
+# LLM call per question, built anew on every call. QueryAnalyzer
+#
+# * builds `llm.with_structured_output(schema)` once
+# * keeps an LRU cache of normalised question -> result
+# * optionally asks a local classifier first and only calls the model when
+#   the classifier is not confident enough
+#
+# so that common questions go straight to retrieval.
+
+
+# Local section classifier ----------------------------------------------------
+#
+# Only short-circuits questions whose position words clearly refer to the
+# document itself. The question is passed on unchanged as the search query;
+# only the section is set:
+#
+#   "What does the end of the post say about Task Decomposition?"
+#   -> {"query": <the question>, "section": "end"}, confidence 0.9
+#
+# Confidence by how specific the match is:
+#
+# * 0.9  "the end of the post", "the introduction of the article", ...
+# * 0.85 "in the first part", "at the last section" (part / section, not
+#        followed by "of <something else>")
+# * 0.5  "in the conclusion" - a position word without the document
+# * 0.3  phrases for several sections
+# * 0.0  nothing - "the end-to-end pipeline", "the ending of a task",
+#        "an introduction to ReAct"
+#
+# With the default threshold of 0.8 only the first two skip the model.
+
+SECTION_CUES = {
+    "beginning": ("beginning", "start", "intro", "introduction", "opening",
+                  "first part", "first section"),
+    "middle": ("middle", "middle part", "middle section", "main part",
+               "second part", "second section"),
+    "end": ("end", "ending", "conclusion", "last part", "last section",
+            "final part", "final section"),
+}
+
+_DOCUMENT = r"(?:post|article|blog(?:\s+post)?|text|document|page)"
+# word boundaries that also exclude hyphenated compounds ("end-to-end")
+_START, _STOP = r"(?<![\w-])", r"(?![\w-])"
+
+
+def _alternation(phrases) -> str:
+    # longest phrases first, so "final section" wins over "final"
+    return "|".join(
+        re.escape(phrase).replace(r"\ ", r"\s+")
+        for phrase in sorted(phrases, key=len, reverse=True)
+    )
+
+
+class SectionClassifier:
+
+    def __init__(self, cues: dict = None) -> None:
+        cues = cues or SECTION_CUES
+        self._sections = {phrase: section for section, items in cues.items() for phrase in items}
+        phrases = _alternation(self._sections)
+        parts = _alternation(
+            phrase for phrase in self._sections if phrase.endswith(("part", "section"))
+        )
+        self._patterns = [
+            # "the end of the post", "the first part of this article"
+            (0.9, re.compile(
+                _START + r"the\s+(" + phrases + r")(?:\s+(?:part|section))?\s+of\s+"
+                r"(?:the|this)\s+" + _DOCUMENT + _STOP,
+                re.IGNORECASE,
+            )),
+            # "in the first part", but not "in the first part of the pipeline"
+            (0.85, re.compile(
+                _START + r"(?:in|at|from)\s+the\s+(" + parts + ")" + _STOP + r"(?!\s+of\b)",
+                re.IGNORECASE,
+            )),
+            # "in the conclusion" - probably the document, but not certain
+            (0.5, re.compile(
+                _START + r"(?:in|at|from)\s+the\s+(" + phrases + ")" + _STOP + r"(?!\s+of\b)",
+                re.IGNORECASE,
+            )),
+        ]
+
+    def classify(self, question: str):
+        """Return (search, confidence) for a question."""
+        found = {}  # section -> best confidence
+        for confidence, pattern in self._patterns:
+            for match in pattern.finditer(question):
+                section = self._sections[re.sub(r"\s+", " ", match.group(1).lower())]
+                found[section] = max(found.get(section, 0.0), confidence)
+
+        query = question.strip()
+        if len(found) == 1:
+            section, confidence = found.popitem()
+            return {"query": query, "section": section}, confidence
+        if not found:
+            return {"query": query, "section": "beginning"}, 0.0
+        return {"query": query, "section": sorted(found)[0]}, 0.3
+
+
+def _normalise(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+class QueryAnalyzer:
+
+    def __init__(self, llm, schema, classifier=None, threshold: float = 0.8,
+                 cache_size: int = 1024) -> None:
+        # built once instead of on every call
+        self.structured_llm = llm.with_structured_output(schema)
+        self.classifier = classifier
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "classifier": 0, "llm": 0}
+
+    def _cached(self, key: str):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return dict(self._cache[key])
+        return None
+
+    def _store(self, key: str, search, source: str):
+        with self._lock:
+            self.stats[source] += 1
+            self._cache[key] = dict(search)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return search
+
+    def _classify(self, question: str):
+        if self.classifier is None:
+            return None
+        search, confidence = self.classifier.classify(question)
+        return search if confidence >= self.threshold else None
+
+    def invoke(self, question: str):
+        key = _normalise(question)
+        if (search := self._cached(key)) is not None:
+            return search
+        if (search := self._classify(question)) is not None:
+            return self._store(key, search, "classifier")
+        return self._store(key, self.structured_llm.invoke(question), "llm")
+
+    async def ainvoke(self, question: str):
+        key = _normalise(question)
+        if (search := self._cached(key)) is not None:
+            return search
+        if (search := self._classify(question)) is not None:
+            return self._store(key, search, "classifier")
+        return self._store(key, await self.structured_llm.ainvoke(question), "llm")
+
+
+# Quick check: python query_analysis.py ---------------------------------------
+
+if __name__ == "__main__":
+    classifier = SectionClassifier()
+    for question in [
+        "What does the end of the post say about Task Decomposition?",
+        "What is said about memory in the beginning of the post?",
+        "What is explained in the first part?",
+        "In the conclusion, what are the challenges of LLM agents?",
+        "How does the middle part describe tool use?",
+        "What is Chain of Thought?",
+        "Compare the intro of the post with the conclusion of the post",
+        "What is the end-to-end pipeline?",
+        "Is there an introduction to ReAct?",
+        "How do agents handle the ending of a task?",
+        "Explain the start of planning",
+        "conclusions drawn by agents",
+        "What happens in the first part of the pipeline?",
+    ]:
+        search, confidence = classifier.classify(question)
+        print(f"{confidence:.2f}  {search['section']:9}  <- {question}")
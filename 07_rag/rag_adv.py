@@ -2,14 +2,14 @@
 import getpass
 import os
 
-from langchain.chat_models import init_chat_model
-
 # embedding
 from langchain_core.embeddings import DeterministicFakeEmbedding
 # from langchain_ollama import OllamaEmbeddings
 
 # vector store
-from langchain_core.vectorstores import InMemoryVectorStore
+# from langchain_core.vectorstores import InMemoryVectorStore
+from vector_store import BatchInMemoryVectorStore, SearchBatcher
+from query_analysis import QueryAnalyzer, SectionClassifier
 # from langchain_chroma import Chroma
 
 # actual graph
@@ -17,11 +17,21 @@ import bs4
 from langchain import hub
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableLambda
+# from langchain_text_splitters import RecursiveCharacterTextSplitter
+from fast_splitter import FastRecursiveCharacterTextSplitter
+from dedup import NearDuplicateFilter
 from langgraph.graph import START, StateGraph
 from typing_extensions import List, TypedDict, Annotated
 from typing import Literal
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.cascade import STRONG_MODEL, ModelCascade, confident
+from utils.clients import get_chat_model
+from utils.profiler import with_profiling
+
 
 # setup environment ----------------------------------------------
 
@@ -39,7 +49,13 @@ _set_env("LANGSMITH_API_KEY", file_name="../langsmith_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-llm = init_chat_model("claude-3-haiku-20240307", model_provider="anthropic")
+llm = get_chat_model("claude-3-haiku-20240307", model_provider="anthropic")
+# answers come from haiku; sonnet only answers when haiku hedges or is cut off
+# (see utils/cascade.py)
+answer_model = ModelCascade(
+    [("haiku", llm), ("sonnet", get_chat_model(STRONG_MODEL, model_provider="anthropic"))],
+    checks=[confident()],
+)
 
 # going for a cheap demo here, see https://python.langchain.com/docs/tutorials/rag/#langsmith 
 # for more information
@@ -47,7 +63,20 @@ embeddings = DeterministicFakeEmbedding(size=4096)
 # embeddings = OllamaEmbeddings(model="llama3")
 
 # Define the vector store. Again, going for cheap option.
-vector_store = InMemoryVectorStore(embeddings)
+# (BatchInMemoryVectorStore is an InMemoryVectorStore that can also answer
+# many queries with one matrix product, see vector_store.py)
+vector_store = BatchInMemoryVectorStore(embeddings)
+# compressed alternative: int8 vectors (4x less memory than float32) with an
+# exact re-scoring of the best candidates, see quantization.py
+# vector_store = BatchInMemoryVectorStore(embeddings, storage="int8", rerank=4)
+# index too large for one process: spread it over worker processes, every
+# search asks all shards and merges their hits, see sharded_store.py
+# from sharded_store import ShardedVectorStore
+# (this script runs at import time: create the store before anything starts
+# threads, so the shards can be forked - see sharded_store.py)
+# vector_store = ShardedVectorStore(embeddings, n_shards=4, timeout=2.0)
+# concurrent retrieve calls, e.g. from graph.batch(), are answered together
+search_batcher = SearchBatcher(vector_store)
 # vector_store = Chroma(embedding_function=embeddings)
 
 class Search(TypedDict):
@@ -60,6 +89,12 @@ class Search(TypedDict):
         "Section to query.",
     ]
 
+# the structured-output model is built once; answers are cached per question,
+# and questions that name a section ("... the end of the post ...") are
+# analysed locally without an LLM call (query_analysis.py).
+# Use classifier=None to always ask the model.
+query_analyzer = QueryAnalyzer(llm, Search, classifier=SectionClassifier(), threshold=0.8)
+
 # Define the graph ------------------------------------------------
 
 # Load and chunk contents of some blog
@@ -75,7 +110,9 @@ docs = loader.load()
 
 
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+# same chunks as RecursiveCharacterTextSplitter, but offset based, with
+# `start_index` in the metadata and parallel over documents (fast_splitter.py)
+text_splitter = FastRecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 all_splits = text_splitter.split_documents(docs)
 
 # annotate the sections of the document
@@ -90,6 +127,13 @@ for i, document in enumerate(all_splits):
     else:
         document.metadata["section"] = "end"
 
+# drop near-identical chunks (re-crawled pages, repeated boilerplate) before
+# they are embedded; chunks of different sections are never merged, and a
+# kept chunk lists the chunks it replaced in metadata["duplicates"] (dedup.py)
+dedup = NearDuplicateFilter(threshold=0.8, keep_apart=("section",))
+all_splits = dedup.filter(all_splits)
+print(f">> Dedup at ingest: {dedup.report()}")
+
 
 # Index chunks
 _ = vector_store.add_documents(documents=all_splits)
@@ -107,17 +151,18 @@ class State(TypedDict):
 
 # NEW: analyze and improve the query
 def analyze_query(state: State):
-    structured_llm = llm.with_structured_output(Search)
-    query = structured_llm.invoke(state["question"])
+    query = query_analyzer.invoke(state["question"])
     return {"query": query}
 
 
 # NEW retrieve function
 def retrieve(state: State):
     query = state["query"]
-    retrieved_docs = vector_store.similarity_search(
+    # the metadata filter is given as a dict, so it can be shared by all
+    # queries of a batch
+    retrieved_docs = search_batcher.similarity_search(
         query["query"],
-        filter=lambda doc: doc.metadata.get("section") == query["section"],
+        filter={"section": query["section"]},
     )
     return {"context": retrieved_docs}
 
@@ -125,12 +170,40 @@ def retrieve(state: State):
 def generate(state: State):
     docs_content = "\n\n".join(doc.page_content for doc in state["context"])
     messages = prompt.invoke({"question": state["question"], "context": docs_content})
-    response = llm.invoke(messages)
+    response = answer_model.invoke(messages)
+    return {"answer": response.content}
+
+
+# async variants of the steps, used by ainvoke() / astream()
+async def aanalyze_query(state: State):
+    query = await query_analyzer.ainvoke(state["question"])
+    return {"query": query}
+
+
+async def aretrieve(state: State):
+    query = state["query"]
+    retrieved_docs = await vector_store.asimilarity_search(
+        query["query"],
+        filter={"section": query["section"]},
+    )
+    return {"context": retrieved_docs}
+
+
+async def agenerate(state: State):
+    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+    messages = await prompt.ainvoke({"question": state["question"], "context": docs_content})
+    response = await answer_model.ainvoke(messages)
     return {"answer": response.content}
 
 
 # Compile application and test
-graph_builder = StateGraph(State).add_sequence([analyze_query, retrieve, generate])
+# each step is registered with its sync and async variant, so the graph
+# works with invoke()/stream() as well as ainvoke()/astream()
+graph_builder = StateGraph(State).add_sequence([
+    ("analyze_query", RunnableLambda(analyze_query, afunc=aanalyze_query)),
+    ("retrieve", RunnableLambda(retrieve, afunc=aretrieve)),
+    ("generate", RunnableLambda(generate, afunc=agenerate)),
+])
 graph_builder.add_edge(START, "analyze_query")
 graph = graph_builder.compile()
 
@@ -141,8 +214,14 @@ with open("state_graph.png", "wb") as f:
     f.write(graph.get_graph().draw_mermaid_png())
 
 
+# GRAPH_PROFILE=1 writes a collapsed-stack profile of the run to profiles/,
+# tagged with the node names (utils/profiler.py)
 for step in graph.stream(
     {"question": "What does the end of the post say about Task Decomposition?"},
+    with_profiling(),
     stream_mode="updates",
 ):
     print(f"{step}\n\n----------------\n")
+
+print(f">> Query analysis: {query_analyzer.stats}")
+print(f">> Answer model tiers: {answer_model.stats.report()}")
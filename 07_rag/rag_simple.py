@@ -2,14 +2,13 @@
 import getpass
 import os
 
-from langchain.chat_models import init_chat_model
-
 # embedding
 from langchain_core.embeddings import DeterministicFakeEmbedding
 # from langchain_ollama import OllamaEmbeddings
 
 # vector store
-from langchain_core.vectorstores import InMemoryVectorStore
+# from langchain_core.vectorstores import InMemoryVectorStore
+from vector_store import BatchInMemoryVectorStore, SearchBatcher
 # from langchain_chroma import Chroma
 
 # actual graph
@@ -17,10 +16,17 @@ import bs4
 from langchain import hub
 from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableLambda
+# from langchain_text_splitters import RecursiveCharacterTextSplitter
+from fast_splitter import FastRecursiveCharacterTextSplitter
 from langgraph.graph import START, StateGraph
 from typing_extensions import List, TypedDict
 
+# shared clients (one keep-alive connection pool per process) live in ../utils
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.clients import get_chat_model
+
 
 # setup environment ----------------------------------------------
 
@@ -38,7 +44,7 @@ _set_env("LANGSMITH_API_KEY", file_name="../langsmith_api_key.txt")
 
 # define tools ----------------------------------------------------
 
-llm = init_chat_model("claude-3-haiku-20240307", model_provider="anthropic")
+llm = get_chat_model("claude-3-haiku-20240307", model_provider="anthropic")
 
 # going for a cheap demo here, see https://python.langchain.com/docs/tutorials/rag/#langsmith 
 # for more information
@@ -46,7 +52,14 @@ embeddings = DeterministicFakeEmbedding(size=4096)
 # embeddings = OllamaEmbeddings(model="llama3")
 
 # Define the vector store. Again, going for cheap option.
-vector_store = InMemoryVectorStore(embeddings)
+# (BatchInMemoryVectorStore is an InMemoryVectorStore that can also answer
+# many queries with one matrix product, see vector_store.py)
+vector_store = BatchInMemoryVectorStore(embeddings)
+# compressed alternative: int8 vectors (4x less memory than float32) with an
+# exact re-scoring of the best candidates, see quantization.py
+# vector_store = BatchInMemoryVectorStore(embeddings, storage="int8", rerank=4)
+# concurrent retrieve calls, e.g. from graph.batch(), are answered together
+search_batcher = SearchBatcher(vector_store)
 # vector_store = Chroma(embedding_function=embeddings)
 
 
@@ -63,7 +76,9 @@ loader = WebBaseLoader(
 )
 docs = loader.load()
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+# same chunks as RecursiveCharacterTextSplitter, but offset based, with
+# `start_index` in the metadata and parallel over documents (fast_splitter.py)
+text_splitter = FastRecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
 all_splits = text_splitter.split_documents(docs)
 
 # Index chunks
@@ -82,7 +97,7 @@ class State(TypedDict):
 
 # Define application steps
 def retrieve(state: State):
-    retrieved_docs = vector_store.similarity_search(state["question"])
+    retrieved_docs = search_batcher.similarity_search(state["question"])
     return {"context": retrieved_docs}
 
 
@@ -93,8 +108,26 @@ def generate(state: State):
     return {"answer": response.content}
 
 
+# async variants of the steps, used by ainvoke() / astream()
+async def aretrieve(state: State):
+    retrieved_docs = await vector_store.asimilarity_search(state["question"])
+    return {"context": retrieved_docs}
+
+
+async def agenerate(state: State):
+    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
+    messages = await prompt.ainvoke({"question": state["question"], "context": docs_content})
+    response = await llm.ainvoke(messages)
+    return {"answer": response.content}
+
+
 # Compile application and test
-graph_builder = StateGraph(State).add_sequence([retrieve, generate])
+# each step is registered with its sync and async variant, so the graph
+# works with invoke()/stream() as well as ainvoke()/astream()
+graph_builder = StateGraph(State).add_sequence([
+    ("retrieve", RunnableLambda(retrieve, afunc=aretrieve)),
+    ("generate", RunnableLambda(generate, afunc=agenerate)),
+])
 graph_builder.add_edge(START, "retrieve")
 graph = graph_builder.compile()
 
@@ -105,6 +138,10 @@ with open("state_graph.png", "wb") as f:
     f.write(graph.get_graph().draw_mermaid_png())
 
 
+# many questions at once: the retrieve steps of all inputs are combined
+# into one batch_similarity_search() call
+# responses = graph.batch([{"question": q} for q in questions])
+
 response = graph.invoke({"question": "What is the content about?"})
 
 print(f'>> Question: {response["question"]}\n\n')
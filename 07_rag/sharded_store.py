@@ -0,0 +1,325 @@
+import builtins
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future, InvalidStateError, TimeoutError, wait
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from vector_store import BatchInMemoryVectorStore, embed_queries
+
+
+# Sharded vector store with scatter-gather search ---------------------------
+#
+# One InMemoryVectorStore lives in one process, so the index is limited to
+# one core and the RAM of one machine. ShardedVectorStore spreads the chunks
+# over N shards (by a hash of the document id), and every search is
+#
+#   scatter: the query embeddings are sent to all shards at once
+#   gather:  every shard returns its local top-k, the coordinator merges them
+#
+# A shard that does not answer within `timeout` seconds (slow, or dead) is
+# skipped: the search returns the best hits of the other shards and the miss
+# is counted in `stats`.
+#
+# Shards only need `submit(op, payload) -> Future` and `alive`, so the local
+# worker processes below can later be complemented by shards on remote nodes.
+#
+# Filters are sent to the worker processes, so only metadata dicts like
+# {"section": "end"} are accepted; callables raise a TypeError.
+#
+# Worker processes are forked only while the process has no other threads
+# (a fork copies locks that another thread may hold). Otherwise they come
+# from a fork server (or are spawned), which imports the main script again:
+# a script that creates the store after starting threads needs its demo
+# under `if __name__ == "__main__":`. The store starts all its shard
+# processes before their receiver threads, so a fresh script can fork.
+
+
+# the loop that runs inside each worker process
+def _shard_main(conn, storage_options: dict) -> None:
+    store = BatchInMemoryVectorStore(None, **storage_options)
+    while True:
+        try:
+            request_id, op, payload = conn.recv()
+        except EOFError:
+            return
+        if op == "stop":
+            conn.send((request_id, True, None))
+            return
+        try:
+            if op == "add":
+                documents, vectors, ids = payload
+                result = store.add_documents_with_vectors(documents, vectors, ids)
+            elif op == "search":
+                embeddings, k, filters = payload
+                result = [
+                    [(score, doc.id, doc.page_content, doc.metadata) for doc, score in hits]
+                    for hits in store.batch_similarity_search_with_score_by_vector(
+                        embeddings, k, filters
+                    )
+                ]
+            elif op == "delete":
+                store.delete(payload)
+                result = None
+            elif op == "stats":
+                result = store.memory_usage()
+            elif op == "sleep":  # used to simulate a slow shard
+                time.sleep(payload)
+                result = None
+            else:
+                raise ValueError(f"Unknown shard operation {op!r}")
+            conn.send((request_id, True, result))
+        except Exception as error:
+            # type name and message only: the exception itself may not be
+            # picklable, and a failing send would end this loop
+            conn.send((request_id, False, (type(error).__name__, str(error))))
+
+
+# the exception for an error reported by a worker: built-in exception types
+# are raised again as such, all others as a RuntimeError
+def _shard_error(name: str, message: str) -> Exception:
+    error_type = getattr(builtins, name, None)
+    if isinstance(error_type, type) and issubclass(error_type, Exception):
+        try:
+            return error_type(message)
+        except TypeError:  # e.g. UnicodeDecodeError needs more arguments
+            pass
+    return RuntimeError(f"{name}: {message}")
+
+
+def _mp_context():
+    # fork keeps the worker start-up cheap and does not re-import the main
+    # script (which in this folder runs the whole demo at import time), but
+    # is only safe while no other thread runs
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ProcessShard:
+    """One shard of the index in a local worker process."""
+
+    # start_receiving=False leaves the receiver thread to start_receiving(),
+    # so several shards can be started before any of their threads exist
+    def __init__(self, storage_options=None, context=None, start_receiving: bool = True) -> None:
+        context = context or _mp_context()
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_shard_main, args=(child_conn, storage_options or {}), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self._send_lock = threading.Lock()
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._dead = False
+        self._request_ids = itertools.count()
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        if start_receiving:
+            self.start_receiving()
+
+    def start_receiving(self) -> None:
+        self._receiver.start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def submit(self, op: str, payload=None) -> Future:
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._futures_lock:
+            if self._dead:
+                future.set_exception(ConnectionError("Shard process died"))
+                return future
+            self._futures[request_id] = future
+        try:
+            with self._send_lock:
+                self._conn.send((request_id, op, payload))
+        except Exception as error:
+            # e.g. a payload that cannot be pickled - no answer will come
+            with self._futures_lock:
+                self._futures.pop(request_id, None)
+            if isinstance(error, OSError):  # includes BrokenPipeError
+                error = ConnectionError(f"Shard is not reachable: {error}")
+            future.set_exception(error)
+        return future
+
+    # resolves the futures with the answers of the worker process
+    def _receive(self) -> None:
+        while True:
+            try:
+                request_id, ok, result = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._futures_lock:
+                future = self._futures.pop(request_id, None)
+            if future is None or future.cancelled():
+                continue  # the caller gave up on this request already
+            try:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(_shard_error(*result))
+            except InvalidStateError:
+                pass  # cancelled in the meantime
+        # the worker is gone: fail everything that still waits for it
+        with self._futures_lock:
+            self._dead = True
+            pending, self._futures = self._futures, {}
+        for future in pending.values():
+            if not future.cancelled():
+                future.set_exception(ConnectionError("Shard process died"))
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self.alive:
+            try:
+                self.submit("stop").result(timeout)
+            except Exception:
+                self.process.terminate()
+        self.process.join(timeout)
+        self._conn.close()
+
+
+class ShardedVectorStore(VectorStore):
+
+    def __init__(self, embedding, n_shards: int = 4, timeout: float = 2.0,
+                 shards=None, **storage_options) -> None:
+        self.embedding = embedding
+        self.timeout = timeout
+        if shards is None:
+            # all processes first, with one start method, then the threads
+            context = _mp_context()
+            shards = [ProcessShard(storage_options, context, start_receiving=False)
+                      for _ in range(n_shards)]
+            for shard in shards:
+                shard.start_receiving()
+        self.shards = shards
+        self._stats_lock = threading.Lock()
+        self.stats = {"searches": 0, "shard_timeouts": 0, "shard_errors": 0}
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    # same document id -> same shard, so deletes and re-adds find it again
+    def _shard_of(self, id_: str) -> int:
+        return zlib.crc32(id_.encode()) % len(self.shards)
+
+    def add_documents(self, documents, ids=None, **kwargs) -> list:
+        ids = ids or [doc.id or str(uuid.uuid4()) for doc in documents]
+        vectors = np.asarray(
+            self.embedding.embed_documents([doc.page_content for doc in documents]),
+            dtype=np.float32,
+        )
+        by_shard = {}
+        for position, id_ in enumerate(ids):
+            by_shard.setdefault(self._shard_of(id_), []).append(position)
+        futures = [
+            self.shards[shard].submit(
+                "add",
+                (
+                    [documents[p] for p in positions],
+                    vectors[positions],
+                    [ids[p] for p in positions],
+                ),
+            )
+            for shard, positions in by_shard.items()
+        ]
+        for future in futures:
+            future.result()  # adding must not silently lose documents
+        return list(ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> list:
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
+        return self.add_documents(documents, ids=ids)
+
+    def delete(self, ids=None, **kwargs) -> None:
+        by_shard = {}
+        for id_ in ids or []:
+            by_shard.setdefault(self._shard_of(id_), []).append(id_)
+        for future in [self.shards[s].submit("delete", i) for s, i in by_shard.items()]:
+            future.result()
+
+    # scatter all queries to all shards, gather and merge the top-k
+    def batch_similarity_search_with_score_by_vector(self, embeddings, k: int = 4,
+                                                     filters=None) -> list:
+        for filter in filters if isinstance(filters, list) else [filters]:
+            if filter is not None and not isinstance(filter, dict):
+                raise TypeError(
+                    f"Sharded search only supports metadata dict filters, got {filter!r}"
+                )
+        payload = (np.asarray(embeddings, dtype=np.float32), k, filters)
+        futures = [shard.submit("search", payload) for shard in self.shards]
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        merged = [[] for _ in embeddings]
+        errors = 0
+        for future in done:
+            if future.exception() is not None:
+                errors += 1
+                continue
+            for hits, shard_hits in zip(merged, future.result()):
+                hits.extend(shard_hits)
+        for future in not_done:
+            future.cancel()
+
+        with self._stats_lock:
+            self.stats["searches"] += 1
+            self.stats["shard_timeouts"] += len(not_done)
+            self.stats["shard_errors"] += errors
+        if len(not_done) + errors == len(self.shards):
+            raise TimeoutError("No shard answered the search in time")
+
+        return [
+            [
+                (Document(id=id_, page_content=text, metadata=metadata), score)
+                for score, id_, text, metadata in heapq.nlargest(k, hits, key=lambda hit: hit[0])
+            ]
+            for hits in merged
+        ]
+
+    def batch_similarity_search(self, queries: list, k: int = 4, filters=None) -> list:
+        embeddings = embed_queries(self.embedding, list(queries))
+        results = self.batch_similarity_search_with_score_by_vector(embeddings, k, filters)
+        return [[doc for doc, _ in hits] for hits in results]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter=None, **kwargs):
+        embedding = self.embedding.embed_query(query)
+        return self.batch_similarity_search_with_score_by_vector([embedding], k, [filter])[0]
+
+    def similarity_search(self, query: str, k: int = 4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter=None, **kwargs):
+        hits = self.batch_similarity_search_with_score_by_vector([embedding], k, [filter])[0]
+        return [doc for doc, _ in hits]
+
+    def shard_stats(self) -> list:
+        futures = [shard.submit("stats") for shard in self.shards]
+        wait(futures, timeout=self.timeout)
+        return [
+            future.result() if future.done() and future.exception() is None else None
+            for future in futures
+        ]
+
+    def close(self) -> None:
+        for shard in self.shards:
+            if hasattr(shard, "close"):
+                shard.close()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas)
+        return store
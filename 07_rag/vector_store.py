@@ -0,0 +1,366 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.load import dumpd
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from quantization import DiskFloat32Storage, Float32Storage, make_storage
+
+
+# In-memory vector store with batched search --------------------------------
+#
+# InMemoryVectorStore turns all stored vectors into a fresh numpy array and
+# scans it for every single query. This store keeps one index of all
+# normalised vectors (updated only after documents were added or deleted) and
+# answers many queries at once:
+#
+#   scores = queries @ vectors.T        (one matrix-matrix product)
+#   top-k per row with np.argpartition  (no full sort)
+#
+# Filters are either callables (like for similarity_search) or dicts of
+# metadata values, e.g. {"section": "end"}. Each distinct filter is only
+# evaluated once per batch.
+#
+# `storage` picks how the vectors are kept (see quantization.py): "float32"
+# keeps them like InMemoryVectorStore does, "float16", "int8" and "pq" store
+# compressed vectors only and drop the list of Python floats per chunk
+# (dump() writes the decoded vectors instead). With `rerank=n` the n * k best
+# approximate hits of a compressed format are re-scored with full-precision
+# vectors that are kept next to the compressed index - in memory, or in a
+# memory-mapped file if `rerank_path` is given.
+
+
+# Queries go through embed_query: models may embed queries and documents
+# differently (instruction prefixes, input_type="query"). There is no batched
+# embed_query in the Embeddings interface, so the queries of a batch are
+# embedded concurrently on a small shared pool.
+_query_pool = ThreadPoolExecutor(8, thread_name_prefix="embed-query")
+
+
+def embed_queries(embedding, queries: list) -> list:
+    if len(queries) == 1:
+        return [embedding.embed_query(queries[0])]
+    return list(_query_pool.map(embedding.embed_query, queries))
+
+
+class BatchInMemoryVectorStore(InMemoryVectorStore):
+
+    def __init__(self, embedding, storage: str = "float32", rerank: int = 0,
+                 rerank_path=None, **storage_options) -> None:
+        super().__init__(embedding)
+        if rerank and storage == "float32":
+            raise ValueError("rerank only applies to the compressed storage formats, "
+                             "float32 scores are exact already")
+        self.storage = storage
+        self.rerank = rerank
+        self._vectors = make_storage(storage, **storage_options)
+        self._full = None
+        if rerank and storage != "float32":
+            self._full = DiskFloat32Storage(rerank_path) if rerank_path else Float32Storage()
+        self._ids = []
+        self._rows = {}
+        self._pending = []
+        self._index_lock = threading.Lock()
+
+    # new vectors are added to the index on the next search
+    def add_documents(self, documents, ids=None, **kwargs):
+        result = super().add_documents(documents, ids=ids, **kwargs)
+        with self._index_lock:
+            self._pending.extend(result)
+        return result
+
+    async def aadd_documents(self, documents, ids=None, **kwargs):
+        result = await super().aadd_documents(documents, ids=ids, **kwargs)
+        with self._index_lock:
+            self._pending.extend(result)
+        return result
+
+    # add documents whose vectors were computed elsewhere, e.g. by the
+    # coordinator of a ShardedVectorStore (see sharded_store.py)
+    def add_documents_with_vectors(self, documents, vectors, ids=None) -> list:
+        ids = ids or [doc.id for doc in documents]
+        added = []
+        for doc, vector, id_ in zip(documents, vectors, ids):
+            id_ = id_ or str(uuid.uuid4())
+            self.store[id_] = {
+                "id": id_,
+                "vector": np.asarray(vector, dtype=float).tolist(),
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+            }
+            added.append(id_)
+        with self._index_lock:
+            self._pending.extend(added)
+        return added
+
+    def delete(self, ids=None, **kwargs):
+        super().delete(ids, **kwargs)
+        with self._index_lock:
+            self._drop_rows(set(ids or []))
+
+    def _drop_rows(self, ids: set) -> None:
+        if not ids.intersection(self._rows):
+            return
+        keep = np.array([id_ not in ids for id_ in self._ids], dtype=bool)
+        self._vectors.keep(keep)
+        if self._full is not None:
+            self._full.keep(keep)
+        self._ids = [id_ for id_ in self._ids if id_ not in ids]
+        self._rows = {id_: row for row, id_ in enumerate(self._ids)}
+
+    def _index(self):
+        with self._index_lock:
+            if self._pending:
+                new_ids = list(dict.fromkeys(id_ for id_ in self._pending if id_ in self.store))
+                self._pending = []
+                # documents that were added again replace their old row
+                self._drop_rows(set(new_ids))
+                vectors = _normalise(np.array(
+                    [self.store[id_]["vector"] for id_ in new_ids], dtype=np.float32
+                ).reshape(len(new_ids), -1))
+                self._vectors.append(vectors)
+                if self._full is not None:
+                    self._full.append(vectors)
+                if self.storage != "float32":
+                    # the compressed index replaces the list of floats
+                    for id_ in new_ids:
+                        self.store[id_]["vector"] = None
+                self._ids.extend(new_ids)
+                self._rows = {id_: row for row, id_ in enumerate(self._ids)}
+            return self._vectors, self._ids
+
+    # the compressed formats keep no vectors in self.store, so the file gets
+    # the vectors decoded from the index (unit length, with the rounding of
+    # the storage format)
+    def dump(self, path: str) -> None:
+        self._index()
+        store = {id_: {**entry, "vector": self._vector(id_)} for id_, entry in self.store.items()}
+        path_ = Path(path)
+        path_.parent.mkdir(exist_ok=True, parents=True)
+        with path_.open("w", encoding="utf-8") as file:
+            json.dump(dumpd(store), file, indent=2)
+
+    # the loaded documents are indexed on the first search
+    @classmethod
+    def load(cls, path: str, embedding, **kwargs) -> "BatchInMemoryVectorStore":
+        vector_store = super().load(path, embedding, **kwargs)
+        vector_store._pending.extend(vector_store.store)
+        return vector_store
+
+    # bytes used by the vector index and the full-precision rerank copy
+    # (in memory and on disk)
+    def memory_usage(self) -> dict:
+        self._index()
+        return {
+            "index_bytes": self._vectors.nbytes,
+            "rerank_bytes": self._full.nbytes if self._full is not None else 0,
+            "rerank_disk_bytes": getattr(self._full, "disk_bytes", 0),
+            "documents": len(self._ids),
+        }
+
+    def _document(self, id_: str) -> Document:
+        entry = self.store[id_]
+        return Document(id=id_, page_content=entry["text"], metadata=entry["metadata"])
+
+    def _vector(self, id_: str) -> list:
+        vector = self.store[id_]["vector"]
+        if vector is None:
+            vector = self._vectors.decode(self._rows[id_]).tolist()
+        return vector
+
+    # boolean mask over the stored documents for one filter
+    def _filter_mask(self, filter, ids: list) -> np.ndarray:
+        if isinstance(filter, dict):
+            return np.fromiter(
+                (
+                    all(self.store[id_]["metadata"].get(key) == value for key, value in filter.items())
+                    for id_ in ids
+                ),
+                dtype=bool,
+                count=len(ids),
+            )
+        return np.fromiter(
+            (bool(filter(self._document(id_))) for id_ in ids), dtype=bool, count=len(ids)
+        )
+
+    def batch_similarity_search_with_score_by_vector(self, embeddings, k: int = 4,
+                                                     filters=None) -> list:
+        vectors, ids = self._index()
+        if not ids or not len(embeddings):
+            return [[] for _ in embeddings]
+        if filters is None or callable(filters) or isinstance(filters, dict):
+            filters = [filters] * len(embeddings)
+
+        queries = _normalise(np.asarray(embeddings, dtype=np.float32))
+        scores = vectors.scores(queries)
+
+        # each distinct filter is evaluated only once for the whole batch
+        masks = {}
+        for row, filter in enumerate(filters):
+            if filter is None:
+                continue
+            key = repr(sorted(filter.items())) if isinstance(filter, dict) else id(filter)
+            if key not in masks:
+                masks[key] = self._filter_mask(filter, ids)
+            scores[row, ~masks[key]] = -np.inf
+
+        n_candidates = min(k * self.rerank if self._full is not None else k, len(ids))
+        top = _top_k(scores, n_candidates)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+
+        if self._full is not None:
+            # exact scores for the candidates, then keep the best k of them
+            for row in range(len(queries)):
+                exact = self._full.decode(top[row]) @ queries[row]
+                top_scores[row] = np.where(top_scores[row] == -np.inf, -np.inf, exact)
+            order = _top_k(top_scores, min(k, n_candidates))
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return [
+            [
+                (self._document(ids[idx]), float(score))
+                for idx, score in zip(row_idx, row_scores)
+                if score != -np.inf  # filtered out
+            ]
+            for row_idx, row_scores in zip(top, top_scores)
+        ]
+
+    def batch_similarity_search(self, queries: list, k: int = 4, filters=None) -> list:
+        """Return the top-k documents for every query string.
+
+        `filters` is None, one filter for all queries or one filter per query;
+        a filter is a callable on Document or a dict of metadata values.
+        """
+        embeddings = embed_queries(self.embedding, list(queries))
+        results = self.batch_similarity_search_with_score_by_vector(embeddings, k, filters)
+        return [[doc for doc, _ in result] for result in results]
+
+    # single queries use the cached index as well
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None,
+                                               **kwargs):
+        return self.batch_similarity_search_with_score_by_vector([embedding], k, [filter])[0]
+
+    def _similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None):
+        results = self.batch_similarity_search_with_score_by_vector([embedding], k, [filter])[0]
+        return [(doc, score, self._vector(doc.id)) for doc, score in results]
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# column indices of the k largest scores per row, best first
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+# Micro-batching of concurrent searches ---------------------------------------
+#
+# graph.batch() runs every input in its own thread, so the retrieve node is
+# called many times at once with one question each. The batcher collects
+# searches that arrive while another batch is running and answers all of them
+# with one batch_similarity_search() call. A search that finds the store idle
+# runs right away; otherwise the first caller of the next batch waits up to
+# `window` seconds for more searches and then runs the search for everyone.
+
+class SearchBatcher:
+
+    def __init__(self, vector_store: BatchInMemoryVectorStore, window: float = 0.002,
+                 max_batch_size: int = 256) -> None:
+        self.vector_store = vector_store
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = 0  # batches being searched right now
+        self._full = threading.Event()
+
+    def similarity_search(self, query: str, k: int = 4, filter=None) -> list:
+        request = {"query": query, "k": k, "filter": filter,
+                   "done": threading.Event(), "result": None, "error": None}
+        with self._lock:
+            self._pending.append(request)
+            leader = len(self._pending) == 1
+            busy = self._running > 0
+            if len(self._pending) >= self.max_batch_size:
+                self._full.set()
+
+        if leader:
+            if busy:
+                self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._full.clear()
+                self._running += 1
+            try:
+                self._run(batch)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def _run(self, batch: list) -> None:
+        try:
+            max_k = max(request["k"] for request in batch)
+            results = self.vector_store.batch_similarity_search(
+                [request["query"] for request in batch],
+                k=max_k,
+                filters=[request["filter"] for request in batch],
+            )
+            for request, result in zip(batch, results):
+                request["result"] = result[:request["k"]]
+        except Exception as error:
+            for request in batch:
+                request["error"] = error
+        finally:
+            for request in batch:
+                request["done"].set()
+
+
+# Quick benchmark: python vector_store.py -------------------------------------
+
+if __name__ == "__main__":
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    n_docs, n_queries, dim = 2000, 64, 4096
+    embeddings = DeterministicFakeEmbedding(size=dim)
+    docs = [
+        Document(page_content=f"chunk {i}", metadata={"section": ("beginning", "middle", "end")[i % 3]})
+        for i in range(n_docs)
+    ]
+    queries = [f"question {i}" for i in range(n_queries)]
+
+    original = InMemoryVectorStore(embeddings)
+    original.add_documents(docs)
+    batched = BatchInMemoryVectorStore(embeddings)
+    batched.add_documents(docs)
+    batched.batch_similarity_search(queries[:1])  # build the matrix once
+
+    start = time.perf_counter()
+    expected = [original.similarity_search(q, k=4, filter=lambda d: d.metadata["section"] == "end") for q in queries]
+    one_by_one = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = batched.batch_similarity_search(queries, k=4, filters={"section": "end"})
+    in_batch = time.perf_counter() - start
+
+    same = [[d.page_content for d in r] for r in expected] == [[d.page_content for d in r] for r in found]
+    print(f">> {n_queries} queries over {n_docs} chunks ({dim} dims)")
+    print(f">> one by one:  {n_queries / one_by_one:8.1f} queries/sec")
+    print(f">> batched:     {n_queries / in_batch:8.1f} queries/sec ({one_by_one / in_batch:.0f}x), same results: {same}")
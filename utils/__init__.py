@@ -0,0 +1,3 @@
+# shared helpers used by the numbered example folders.
+# The scripts add the repository root to sys.path (sys.path.append(".."))
+# and import from here, e.g. `from utils.clients import get_chat_model`.
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+from langchain_core.messages import ToolMessage
+
+
+# Out-of-line storage for large tool outputs --------------------------------
+#
+# A Tavily result is a few KB of JSON. Put into a ToolMessage as is, it is
+# copied into the graph state, written again into every later checkpoint and
+# sent again with every later prompt. Instead, outputs above a threshold go
+# into a content-addressed blob store (key = sha256 of the payload) and the
+# message only keeps a reference:
+#
+#   ToolMessage(content="<first 200 chars> ... [8,214 bytes, blob 3f9a2c...]",
+#               artifact={"blob": "<sha256>", "bytes": 8214})
+#
+# The payload is loaded again right before the model call: materialize()
+# restores every offloaded result in the prompt, so the model sees the same
+# history as without the store - the saving is in the state and checkpoints.
+# With recent_only=True it restores only the results the model has not
+# answered yet (the ToolMessages at the end of the history) and older results
+# stay as previews: shorter prompts, but the model no longer sees the full
+# earlier results. That is an opt-in trade-off, not the default. load()
+# returns the full payload of any message.
+#
+# Stores: DiskBlobStore (one file per blob) and SQLiteBlobStore (one table,
+# e.g. in the same file as the checkpoints). Identical outputs are stored once.
+
+DEFAULT_THRESHOLD = 2048  # bytes
+PREVIEW_CHARS = 200
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _verified(digest: str, data: bytes) -> bytes:
+    if digest_of(data) != digest:
+        raise ValueError(f"Blob {digest[:12]} is corrupted")
+    return data
+
+
+class DiskBlobStore:
+
+    def __init__(self, root: str = "blobs") -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, data: bytes) -> str:
+        digest = digest_of(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write + rename, so readers never see a half-written blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        try:
+            with open(self._path(digest), "rb") as file:
+                return _verified(digest, file.read())
+        except FileNotFoundError:
+            raise KeyError(digest) from None
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+
+class SQLiteBlobStore:
+
+    def __init__(self, path: str = "blobs.sqlite") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL
+                )
+                """
+            )
+
+    def put(self, data: bytes) -> str:
+        digest = digest_of(data)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (digest, data, size) VALUES (?, ?, ?)",
+                (digest, data, len(data)),
+            )
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return _verified(digest, row[0])
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone() is not None
+
+
+BLOB_STORES = {
+    "disk": DiskBlobStore,
+    "sqlite": SQLiteBlobStore,
+}
+
+
+def get_blob_store(name: str = "disk", *args, **kwargs):
+    if name not in BLOB_STORES:
+        raise ValueError(f"Unknown blob store {name!r}, choose one of {sorted(BLOB_STORES)}")
+    return BLOB_STORES[name](*args, **kwargs)
+
+
+# ToolMessage for a tool output; outputs above `threshold` bytes are moved
+# into the store (store=None keeps everything inline). Outputs that are not a
+# string (lists and dicts, e.g. of a Tavily search) are stored as JSON.
+def tool_message(content, tool_call: dict, store=None,
+                 threshold: int = DEFAULT_THRESHOLD) -> ToolMessage:
+    if not isinstance(content, str):
+        content = json.dumps(content, default=str)
+    data = content.encode()
+    if store is None or len(data) <= threshold:
+        return ToolMessage(content=content, name=tool_call["name"], tool_call_id=tool_call["id"])
+    digest = store.put(data)
+    return ToolMessage(
+        content=f"{content[:PREVIEW_CHARS]} ... [{len(data):,} bytes, blob {digest[:12]}]",
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"],
+        artifact={"blob": digest, "bytes": len(data)},
+    )
+
+
+def is_offloaded(message) -> bool:
+    artifact = getattr(message, "artifact", None)
+    return isinstance(artifact, dict) and "blob" in artifact
+
+
+# the full tool output of a message
+def load(message, store) -> str:
+    if not is_offloaded(message):
+        return message.content
+    return store.get(message.artifact["blob"]).decode()
+
+
+# the messages for the next model call: offloaded tool results get their
+# full payload back - all of them, or with recent_only=True only the tool
+# results at the end of the history (not answered by the model yet); all
+# other messages are passed on unchanged
+def materialize(messages: list, store, recent_only: bool = False) -> list:
+    messages = list(messages)
+    if recent_only:
+        first = len(messages)
+        while first > 0 and isinstance(messages[first - 1], ToolMessage):
+            first -= 1
+    else:
+        first = 0
+    for position in range(first, len(messages)):
+        message = messages[position]
+        if is_offloaded(message):
+            messages[position] = message.model_copy(update={"content": load(message, store)})
+    return messages
+
+
+# Benchmark: python -m utils.blobs -------------------------------------------
+#
+# A 50-turn search-bot history (question, tool call, 8 KB search result,
+# answer). A checkpoint with the whole history is written after every turn;
+# compared are the size of the last checkpoint, the time to serialise all of
+# them and the size of the prompt of the last model call (with all results
+# restored, and with recent_only=True).
+
+if __name__ == "__main__":
+    import shutil
+    import time
+
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    from utils.serde import get_serde
+
+    turns, result_size = 50, 8 * 1024
+    root = tempfile.mkdtemp()
+    stores = {"inline": None, "disk": DiskBlobStore(os.path.join(root, "blobs")),
+              "sqlite": SQLiteBlobStore(os.path.join(root, "blobs.sqlite"))}
+    serde = get_serde("msgpack")
+
+    print(f">> {turns} turns, {result_size:,} byte tool results\n")
+    print(f"{'store':8} {'checkpoint bytes':>17} {'serialise ms':>13} "
+          f"{'last prompt chars':>18} {'recent_only':>12} {'materialize ms':>15}")
+    for name, store in stores.items():
+        messages, checkpoints, seconds = [], [], 0.0
+        for turn in range(turns):
+            call = {"name": "tavily_search_results_json", "args": {"query": f"q{turn}"},
+                    "id": f"call_{turn}"}
+            result = json.dumps([{"url": f"https://example.com/{turn}",
+                                  "content": f"turn {turn} " * (result_size // 8)}])
+            messages += [HumanMessage(f"question {turn}"), AIMessage("", tool_calls=[call]),
+                         tool_message(result, call, store),
+                         AIMessage(f"answer {turn}")]
+            start = time.perf_counter()
+            checkpoints.append(serde.dumps_typed({"messages": messages}))
+            seconds += time.perf_counter() - start
+        # the prompt of the last model call: everything up to the last result
+        start = time.perf_counter()
+        prompt = messages[:-1] if store is None else materialize(messages[:-1], store)
+        materialize_time = time.perf_counter() - start
+        recent = messages[:-1] if store is None else materialize(messages[:-1], store, recent_only=True)
+        assert prompt[-1].content == result and recent[-1].content == result
+        # without recent_only the model sees exactly the inline history
+        if store is None:
+            inline_prompt = prompt
+        assert [m.content for m in prompt] == [m.content for m in inline_prompt]
+        chars = sum(len(str(message.content)) for message in prompt)
+        recent_chars = sum(len(str(message.content)) for message in recent)
+        print(f"{name:8} {len(checkpoints[-1][1]):17,} {seconds * 1000:13.1f} "
+              f"{chars:18,} {recent_chars:12,} {materialize_time * 1000:15.2f}")
+    shutil.rmtree(root)
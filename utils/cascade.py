@@ -0,0 +1,300 @@
+import re
+import threading
+import time
+
+from langchain_core.runnables import Runnable, ensure_config
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+# Model cascade: fast model first, stronger model only when needed ---------
+#
+# ModelCascade tries the tiers in order (e.g. haiku, then sonnet). The answer
+# of a tier is used if it passes all checks; otherwise - or if the call
+# fails - the next tier is asked. The last tier's answer is always used.
+#
+# A check is a function `check(output) -> bool`. Ready-made ones:
+#
+# * matches_schema(WeatherResponse) - structured output validates
+# * valid_tool_calls(tools)         - tool calls name known tools, with
+#                                     arguments that fit their schema
+# * confident()                     - not cut off at max_tokens and no
+#                                     "I don't know"-style hedging
+#
+# The cascade is used like a chat model (invoke, ainvoke, bind_tools,
+# with_structured_output), so it can be wrapped by scheduled(...) and
+# bind_tools_cached(...). Calls, accepted answers, escalations, errors and
+# latency are counted per tier in `stats`.
+
+# matched as whole phrases at the start of a sentence (optionally after
+# "sorry," or "unfortunately,"), so "there is no information loss" in the
+# middle of an answer does not count
+HEDGES = (
+    "i don't know",
+    "i do not know",
+    "i'm not sure",
+    "i am not sure",
+    "i cannot answer",
+    "i can't answer",
+    "i don't have enough information",
+    "i do not have enough information",
+    "i have no information",
+    "there is not enough information",
+    "there isn't enough information",
+)
+
+
+def matches_schema(schema):
+    def check(output) -> bool:
+        if isinstance(output, dict) and "parsed" in output:  # include_raw=True
+            if output.get("parsing_error") is not None:
+                return False
+            output = output["parsed"]
+        if isinstance(output, schema):
+            return True
+        try:
+            schema.model_validate(output)
+        except Exception:
+            return False
+        return True
+    check.__name__ = f"matches_schema({schema.__name__})"
+    return check
+
+
+def valid_tool_calls(tools: list):
+    schemas = {}
+    for tool in tools:
+        if isinstance(tool, BaseTool):
+            schemas[tool.name] = tool.args_schema
+        else:
+            # functions, pydantic models and dict schemas (OpenAI or Anthropic
+            # format): only the name is checked
+            schemas[convert_to_openai_tool(tool)["function"]["name"]] = None
+
+    def check(message) -> bool:
+        if getattr(message, "invalid_tool_calls", None):
+            return False
+        for call in getattr(message, "tool_calls", []):
+            if call["name"] not in schemas:
+                return False
+            schema = schemas[call["name"]]
+            if hasattr(schema, "model_validate"):
+                try:
+                    schema.model_validate(call["args"])
+                except Exception:
+                    return False
+        return True
+    return check
+
+
+def confident(hedges=HEDGES):
+    hedging = re.compile(
+        r"(?:^|(?<=[.!?:\n]))\s*(?:(?:sorry|unfortunately),?\s+)?(?:"
+        + "|".join(re.escape(hedge) for hedge in hedges)
+        + r")(?![\w'])"
+    )
+
+    def check(message) -> bool:
+        metadata = getattr(message, "response_metadata", {}) or {}
+        if metadata.get("stop_reason") == "max_tokens":
+            return False
+        text = str(getattr(message, "text", "") or "").lower().replace("’", "'")
+        return hedging.search(text) is None
+    return check
+
+
+class CascadeStats:
+
+    def __init__(self, names: list) -> None:
+        self._lock = threading.Lock()
+        self.tiers = {
+            name: {"calls": 0, "accepted": 0, "escalated": 0, "errors": 0, "seconds": 0.0}
+            for name in names
+        }
+
+    def record(self, name: str, outcome: str, seconds: float) -> None:
+        with self._lock:
+            tier = self.tiers[name]
+            tier["calls"] += 1
+            tier[outcome] += 1
+            tier["seconds"] += seconds
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "calls": tier["calls"],
+                    "accepted": tier["accepted"],
+                    "escalated": tier["escalated"],
+                    "errors": tier["errors"],
+                    "avg_latency_ms": 1000 * tier["seconds"] / tier["calls"] if tier["calls"] else 0.0,
+                }
+                for name, tier in self.tiers.items()
+            }
+
+
+class ModelCascade(Runnable):
+    """Tries `tiers` ([(name, model), ...]) in order until one passes `checks`."""
+
+    def __init__(self, tiers: list, checks: list = (), stats: CascadeStats = None) -> None:
+        if not tiers:
+            raise ValueError("A cascade needs at least one tier")
+        self.tiers = list(tiers)
+        self.checks = list(checks)
+        # shared by all bound variants of this cascade
+        self.stats = stats or CascadeStats([name for name, _ in self.tiers])
+
+    def _passes(self, output) -> bool:
+        return all(check(output) for check in self.checks)
+
+    def invoke(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        for position, (name, model) in enumerate(self.tiers):
+            last = position == len(self.tiers) - 1
+            start = time.perf_counter()
+            try:
+                output = model.invoke(input, config, **kwargs)
+            except Exception:
+                self.stats.record(name, "errors", time.perf_counter() - start)
+                if last:
+                    raise
+                continue
+            accepted = last or self._passes(output)
+            self.stats.record(name, "accepted" if accepted else "escalated",
+                              time.perf_counter() - start)
+            if accepted:
+                return output
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        for position, (name, model) in enumerate(self.tiers):
+            last = position == len(self.tiers) - 1
+            start = time.perf_counter()
+            try:
+                output = await model.ainvoke(input, config, **kwargs)
+            except Exception:
+                self.stats.record(name, "errors", time.perf_counter() - start)
+                if last:
+                    raise
+                continue
+            accepted = last or self._passes(output)
+            self.stats.record(name, "accepted" if accepted else "escalated",
+                              time.perf_counter() - start)
+            if accepted:
+                return output
+
+    # `checks` replaces the checks of the cascade for the bound variant
+    def bind_tools(self, tools, checks=None, **kwargs):
+        return ModelCascade(
+            [(name, model.bind_tools(tools, **kwargs)) for name, model in self.tiers],
+            self.checks if checks is None else checks,
+            self.stats,
+        )
+
+    # the checks of the cascade are replaced by a schema check (plus the
+    # extra `checks` given here)
+    def with_structured_output(self, schema, checks: list = (), **kwargs):
+        return ModelCascade(
+            [(name, model.with_structured_output(schema, **kwargs)) for name, model in self.tiers],
+            # pydantic schemas are validated; TypedDict / JSON schemas are not
+            [matches_schema(schema), *checks] if hasattr(schema, "model_validate") else list(checks),
+            self.stats,
+        )
+
+
+FAST_MODEL = "claude-3-haiku-20240307"      # fast, cheap, less accurate
+STRONG_MODEL = "claude-3-5-sonnet-20240620"  # slow, expensive, most accurate
+
+
+# haiku -> sonnet cascade on the shared clients
+def default_cascade(checks: list = (), **kwargs) -> ModelCascade:
+    from utils.clients import get_chat_model
+    return ModelCascade(
+        [
+            ("haiku", get_chat_model(FAST_MODEL, **kwargs)),
+            ("sonnet", get_chat_model(STRONG_MODEL, **kwargs)),
+        ],
+        checks,
+    )
+
+
+# Self-check with fake local models: python -m utils.cascade ----------------
+
+if __name__ == "__main__":
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+    from langchain_core.tools import tool
+    from pydantic import BaseModel
+
+    class FakeModel(FakeMessagesListChatModel):
+        def bind_tools(self, tools, **kwargs):
+            return self.bind(tools=tools, **kwargs)
+
+    def fake(*answers):
+        return FakeModel(responses=[
+            AIMessage(answer) if isinstance(answer, str) else answer for answer in answers
+        ])
+
+    # 1. confident answers stay on the fast tier, hedging escalates
+    cascade = ModelCascade(
+        [("fast", fake("Paris is the capital.", "I don't know.")),
+         ("strong", fake("Berlin is the capital."))],
+        checks=[confident()],
+    )
+    assert cascade.invoke("capital of France?").content == "Paris is the capital."
+    assert cascade.invoke("capital of Germany?").content == "Berlin is the capital."
+    report = cascade.stats.report()
+    assert report["fast"]["accepted"] == 1 and report["fast"]["escalated"] == 1
+    assert report["strong"]["accepted"] == 1
+    # hedge phrases only count as whole phrases at the start of a sentence
+    assert confident()(AIMessage("FLAC has no information loss. I don't knowingly skip it."))
+    assert not confident()(AIMessage("It depends. Unfortunately, I do not know."))
+
+    # 2. tool calls to unknown tools or with wrong arguments escalate
+    @tool
+    def get_weather(city: str):
+        """Get the weather."""
+        return "sunny"
+
+    good = AIMessage("", tool_calls=[{"name": "get_weather", "args": {"city": "Paris"}, "id": "1"}])
+    bad = AIMessage("", tool_calls=[{"name": "get_wether", "args": {"town": "Paris"}, "id": "2"}])
+    cascade = ModelCascade(
+        [("fast", fake(bad, good)), ("strong", fake(good))],
+        checks=[valid_tool_calls([get_weather])],
+    ).bind_tools([get_weather])
+    assert cascade.invoke("weather?").tool_calls[0]["id"] == "1"  # from "strong"
+    assert cascade.invoke("weather?").tool_calls[0]["id"] == "1"  # from "fast"
+    report = cascade.stats.report()
+    assert report["fast"]["accepted"] == 1 and report["fast"]["escalated"] == 1
+
+    # 3. structured output that does not match the schema escalates
+    class WeatherResponse(BaseModel):
+        conditions: str
+        city: str
+
+    check = matches_schema(WeatherResponse)
+    cascade = ModelCascade(
+        [("fast", RunnableLambda(lambda _: {"conditions": "snow"})),
+         ("strong", RunnableLambda(lambda _: WeatherResponse(conditions="snow", city="Berlin")))],
+        checks=[check],
+    )
+    assert cascade.invoke("weather in Berlin?").city == "Berlin"
+
+    # 4. errors of a tier escalate as well, the last tier's errors are raised
+    def broken(_):
+        raise TimeoutError("model overloaded")
+
+    cascade = ModelCascade([("fast", RunnableLambda(broken)), ("strong", fake("ok"))])
+    assert cascade.invoke("hi").content == "ok"
+    assert cascade.stats.report()["fast"]["errors"] == 1
+
+    # 5. async path
+    import asyncio
+    cascade = ModelCascade(
+        [("fast", fake("I am not sure.")), ("strong", fake("Sure."))], checks=[confident()]
+    )
+    assert asyncio.run(cascade.ainvoke("hi")).content == "Sure."
+
+    print(">> all cascade checks passed")
+    print(cascade.stats.report())
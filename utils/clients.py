@@ -0,0 +1,293 @@
+import asyncio
+import threading
+import weakref
+
+# newer anthropic SDKs are built on the `httpx2` fork of httpx and reject
+# plain httpx clients - use whichever one is installed
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+import anthropic
+from langchain_anthropic import ChatAnthropic
+
+from utils.response_cache import cached_model, get_response_cache
+
+# HTTP/2 needs the optional `h2` package - use it if it is installed
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+# Central client factory ------------------------------------------------
+#
+# Every script used to build its own ChatAnthropic / TavilySearchResults
+# with default client settings, so each one opened its own connections.
+# The helpers below (and the Tavily tool in utils/tavily.py) hand out models
+# and tools that all share ONE keep-alive
+# connection pool per process (one sync, plus one async per event loop), so
+# TLS handshakes are paid once and then reused by every node and tool.
+
+
+# pool settings, change them with configure_http_pool() BEFORE the first
+# client is created
+_pool_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 60.0,
+    "http2": _HTTP2_AVAILABLE,
+}
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+_chat_models = {}
+
+
+# counts whether a request could reuse an open connection (hit) or had to
+# open a new TCP connection (miss)
+class PoolStats:
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, opened_connection: bool) -> None:
+        with self._lock:
+            if opened_connection:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+pool_stats = PoolStats()
+
+
+# The transports hook into httpcore's `trace` extension: if a request
+# triggers "connection.connect_tcp", no idle pooled connection was available.
+class _CountingTransport(httpx.HTTPTransport):
+
+    def handle_request(self, request):
+        opened = []
+        outer_trace = request.extensions.get("trace")
+
+        def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                opened.append(True)
+            if outer_trace is not None:
+                outer_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        response = super().handle_request(request)
+        pool_stats.record(bool(opened))
+        return response
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+
+    async def handle_async_request(self, request):
+        opened = []
+        outer_trace = request.extensions.get("trace")
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.started":
+                opened.append(True)
+            if outer_trace is not None:
+                await outer_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        response = await super().handle_async_request(request)
+        pool_stats.record(bool(opened))
+        return response
+
+
+def configure_http_pool(**settings) -> None:
+    """Change pool size, keep-alive, timeout or http2 before the clients are built."""
+    unknown = set(settings) - set(_pool_settings)
+    if unknown:
+        raise ValueError(f"Unknown pool settings: {sorted(unknown)}")
+    with _lock:
+        if _http_client is not None or len(_async_http_clients):
+            raise RuntimeError("The shared HTTP clients have already been created")
+        if settings.get("http2") and not _HTTP2_AVAILABLE:
+            raise ValueError("http2=True requires the `h2` package")
+        _pool_settings.update(settings)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_pool_settings["max_connections"],
+        max_keepalive_connections=_pool_settings["max_keepalive_connections"],
+        keepalive_expiry=_pool_settings["keepalive_expiry"],
+    )
+
+
+# the shared sync client - built on first use
+def get_http_client() -> httpx.Client:
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                transport=_CountingTransport(
+                    limits=_limits(), http2=_pool_settings["http2"]
+                ),
+                timeout=_pool_settings["timeout"],
+            )
+        return _http_client
+
+
+# the shared async client of the running event loop - built on first use.
+# An httpx.AsyncClient cannot be used from another loop than the one it
+# first ran on, so every loop (e.g. one per asyncio.run()) gets its own.
+def get_async_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_http_clients:
+            _async_http_clients[loop] = httpx.AsyncClient(
+                transport=_AsyncCountingTransport(
+                    limits=_limits(), http2=_pool_settings["http2"]
+                ),
+                timeout=_pool_settings["timeout"],
+            )
+        return _async_http_clients[loop]
+
+
+def get_pool_stats() -> dict:
+    return pool_stats.as_dict()
+
+
+# Chat models ------------------------------------------------------------
+
+# ChatAnthropic on the shared pools. The installed langchain-anthropic has no
+# constructor argument for the HTTP client, so this subclass provides the SDK
+# clients the model asks for; they are built from the public model fields and
+# shared by all models with the same client settings (nothing is stored on
+# the model). The async SDK clients are kept per event loop, like their httpx
+# client.
+_sdk_clients = {}  # client settings -> anthropic.Client
+_async_sdk_clients = weakref.WeakKeyDictionary()  # event loop -> {client settings: client}
+
+
+def _settings_key(params: dict) -> tuple:
+    return tuple(
+        (name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+        for name, value in sorted(params.items())
+    )
+
+
+class PooledChatAnthropic(ChatAnthropic):
+
+    def _sdk_params(self) -> dict:
+        params = {
+            "api_key": self.anthropic_api_key.get_secret_value(),
+            "base_url": self.anthropic_api_url,
+            "max_retries": self.max_retries,
+            "default_headers": self.default_headers,
+        }
+        # <= 0 means "not set", None means "no timeout" for the SDK
+        if self.default_request_timeout is None or self.default_request_timeout > 0:
+            params["timeout"] = self.default_request_timeout
+        return params
+
+    @property
+    def _client(self) -> anthropic.Client:
+        params = self._sdk_params()
+        key = _settings_key(params)
+        http_client = get_http_client()
+        with _lock:
+            if key not in _sdk_clients:
+                _sdk_clients[key] = anthropic.Client(**params, http_client=http_client)
+            return _sdk_clients[key]
+
+    @property
+    def _async_client(self) -> anthropic.AsyncClient:
+        params = self._sdk_params()
+        key = _settings_key(params)
+        http_client = get_async_http_client()
+        with _lock:
+            clients = _async_sdk_clients.setdefault(asyncio.get_running_loop(), {})
+            if key not in clients:
+                clients[key] = anthropic.AsyncClient(**params, http_client=http_client)
+            return clients[key]
+
+
+# Returns a chat model that uses the shared connection pool. Calling it
+# again with the same arguments returns the very same model instance, so
+# all nodes of a process share one client. With LLM_RESPONSE_CACHE set, the
+# model records / replays its responses (utils/response_cache.py).
+def get_chat_model(
+    model: str = "claude-3-haiku-20240307",
+    model_provider: str = "anthropic",
+    **kwargs,
+):
+    key = (model, model_provider, tuple(sorted(kwargs.items())))
+    with _lock:
+        llm = _chat_models.get(key)
+    if llm is not None:
+        return llm
+
+    if model_provider == "anthropic":
+        llm = PooledChatAnthropic(model=model, **kwargs)
+    else:
+        # other providers: no pool sharing, but still one instance per process
+        from langchain.chat_models import init_chat_model
+        llm = init_chat_model(model, model_provider=model_provider, **kwargs)
+    if (cache := get_response_cache()) is not None:
+        llm = cached_model(llm, cache)
+
+    with _lock:
+        return _chat_models.setdefault(key, llm)
+
+
+# Check against a local stand-in server ----------------------------------
+#
+# Run `python -m utils.clients` from the repository root: it starts a tiny
+# keep-alive HTTP server on localhost, sends a few requests through the
+# shared client and prints the pool counters (expect 1 miss, N-1 hits).
+
+if __name__ == "__main__":
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep connections alive
+
+        def do_GET(self):
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    n_requests = 20
+    client = get_http_client()
+    for _ in range(n_requests):
+        client.get(url).raise_for_status()
+    print(">> Pool stats after", n_requests, "requests:", get_pool_stats())
+
+    server.shutdown()
@@ -0,0 +1,260 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Sampling profiler for single graph runs -----------------------------------
+#
+# When one turn is slow, the question is where the time goes: checkpoint
+# serde, add_messages, retrieval scoring, the model client, ... GraphProfiler
+# answers it for one graph run. It is a callback, so it only runs when it is
+# put into the config of a call:
+#
+#   graph.invoke(inputs, with_profiling(config))
+#
+# with_profiling() adds it if profiling is asked for - by the config flag
+# {"configurable": {"profile": True}}, by the environment variable
+# GRAPH_PROFILE=1 or by enabled=True.
+#
+# While the run is going, a background thread takes a sample every
+# `interval` seconds: the Python stack of the thread that runs the graph loop
+# and of every thread that runs a node. The samples are written as collapsed
+# stacks, one line per distinct stack, ready for flamegraph.pl or speedscope:
+#
+#   thread_id=1;node=chatbot;bot_with_memory:chatbot;...;ssl:SSLSocket.recv 37
+#
+# "node=<graph>" is time spent in the graph loop itself (checkpointing,
+# add_messages, scheduling). Files go to GRAPH_PROFILE_DIR (default
+# "profiles"), one per run: <thread_id>-<time>.collapsed.
+#
+# The sampler measures its own cost; if it takes more than `max_overhead` of
+# the wall time, it samples less often. Async nodes all run on the event loop
+# thread, so concurrent async nodes are attributed to the one started last.
+
+PROFILE_ENV = "GRAPH_PROFILE"
+PROFILE_DIR_ENV = "GRAPH_PROFILE_DIR"
+GRAPH_NODE = "<graph>"
+
+
+class GraphProfiler(BaseCallbackHandler):
+    # called in the thread of the run, so that nodes can be mapped to threads
+    run_inline = True
+
+    def __init__(self, path: str = None, interval: float = 0.005, max_depth: int = 128,
+                 max_overhead: float = 0.02, verbose: bool = True) -> None:
+        self.path = path
+        self.verbose = verbose
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_overhead = max_overhead
+        self._lock = threading.Lock()
+        self._labels = {}  # code object -> "module:function"
+        self._reset()
+
+    def _reset(self) -> None:
+        self._root = None
+        self._root_thread = None
+        self._graph_thread_id = None
+        self._runs = {}   # run_id -> (thread ident, node)
+        self._nodes = {}  # thread ident -> [run_id, ...] of the nodes running there
+        self._stop = threading.Event()
+        self._sampler = None
+        self.samples = Counter()
+        self.stats = {"samples": 0, "sampler_seconds": 0.0, "wall_seconds": 0.0}
+
+    # callbacks ---------------------------------------------------------
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None,
+                       metadata=None, **kwargs):
+        metadata = metadata or {}
+        ident = threading.get_ident()
+        with self._lock:
+            if parent_run_id is None and self._root is None:
+                self._root = run_id
+                self._root_thread = ident
+                self._graph_thread_id = metadata.get("thread_id")
+                self._started = time.perf_counter()
+                self._sampler = threading.Thread(
+                    target=self._sample_loop, name="graph-profiler", daemon=True
+                )
+                self._sampler.start()
+            node = metadata.get("langgraph_node")
+            if node is not None and self._root is not None:
+                self._runs[run_id] = (ident, node)
+                self._nodes.setdefault(ident, []).append(run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def _end(self, run_id) -> None:
+        with self._lock:
+            entry = self._runs.pop(run_id, None)
+            if entry is not None:
+                runs = self._nodes[entry[0]]
+                runs.remove(run_id)
+                if not runs:
+                    del self._nodes[entry[0]]
+            if run_id != self._root:
+                return
+        self._stop.set()
+        self._sampler.join()
+        self.stats["wall_seconds"] = time.perf_counter() - self._started
+        self.write()
+        self.last_stats = self.stats
+        self._reset()
+
+    # sampling ----------------------------------------------------------
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            module = frame.f_globals.get("__name__", "?")
+            label = self._labels[code] = f"{module}:{code.co_qualname}"
+        return label
+
+    def _sample_loop(self) -> None:
+        interval = self.interval
+        started = time.perf_counter()
+        while not self._stop.wait(interval):
+            start = time.perf_counter()
+            self._sample()
+            now = time.perf_counter()
+            self.stats["sampler_seconds"] += now - start
+            # too expensive for this run: sample less often
+            if self.stats["sampler_seconds"] > self.max_overhead * (now - started):
+                interval = min(interval * 2, 0.1)
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            threads = {ident: self._runs[runs[-1]][1] for ident, runs in self._nodes.items()}
+            threads.setdefault(self._root_thread, GRAPH_NODE)
+        prefix = f"thread_id={self._graph_thread_id}"
+        for ident, node in threads.items():
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._label(frame))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.samples[f"{prefix};node={node};{';'.join(stack)}"] += 1
+        self.stats["samples"] += 1
+
+    # output ------------------------------------------------------------
+
+    def write(self) -> str:
+        path = self.path
+        if path is None:
+            directory = os.environ.get(PROFILE_DIR_ENV, "profiles")
+            os.makedirs(directory, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(
+                directory, f"{self._graph_thread_id or 'no-thread'}-{stamp}-{id(self):x}.collapsed"
+            )
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        if self.verbose:
+            overhead = self.stats["sampler_seconds"] / (self.stats["wall_seconds"] or 1)
+            print(f">> profile: {path} ({self.stats['samples']} samples, "
+                  f"{overhead:.1%} sampler time)")
+        self.last_path = path
+        return path
+
+
+# the config with a GraphProfiler callback added if profiling is asked for
+# (configurable "profile", GRAPH_PROFILE=1 or enabled=True), else unchanged
+def with_profiling(config: dict = None, enabled: bool = None, **kwargs) -> dict:
+    config = dict(config or {})
+    if enabled is None:
+        enabled = bool(config.get("configurable", {}).get("profile")) \
+            or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+    if enabled:
+        config["callbacks"] = [*(config.get("callbacks") or []), GraphProfiler(**kwargs)]
+    return config
+
+
+# Benchmark: python -m utils.profiler ----------------------------------------
+#
+# A memory-bot like graph with a MemorySaver (msgpack serde) and a growing
+# message history: "retrieve" scores 50k vectors with numpy, "chatbot" does
+# some pure Python work and waits 50 ms in place of the model call. Turns are
+# run alternately with and without profiling; reported are the median turn
+# times, the sampler's own share of the wall time and the heaviest leaf
+# frames per node of the profiled runs.
+
+if __name__ == "__main__":
+    import statistics
+    import tempfile
+
+    import numpy as np
+    from langchain_core.messages import AIMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import START, StateGraph
+    from langgraph.graph.message import add_messages
+    from typing_extensions import Annotated, TypedDict
+
+    from utils.serde import get_serde
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    vectors = np.random.default_rng(0).standard_normal((50_000, 256)).astype(np.float32)
+
+    def retrieve(state: State):
+        query = vectors[len(state["messages"]) % len(vectors)]
+        best = np.argsort(vectors @ query)[-4:]
+        return {"messages": [AIMessage(f"context {best.tolist()}")]}
+
+    def chatbot(state: State):
+        text = " ".join(str(message.content) for message in state["messages"])
+        answer = sorted(text.split())[:50]
+        time.sleep(0.05)  # waiting for the model
+        return {"messages": [AIMessage(" ".join(answer) * 20)]}
+
+    builder = StateGraph(State)
+    builder.add_node("retrieve", retrieve)
+    builder.add_node("chatbot", chatbot)
+    builder.add_edge(START, "retrieve")
+    builder.add_edge("retrieve", "chatbot")
+    graph = builder.compile(checkpointer=MemorySaver(serde=get_serde("msgpack")))
+
+    directory = tempfile.mkdtemp()
+    turns = {False: [], True: []}
+    sampler_share = []
+    totals = Counter()
+    for turn in range(60):
+        for profile in (False, True) if turn % 2 else (True, False):
+            config = {"configurable": {"thread_id": f"bench-{profile}"}}
+            if profile:
+                profiler = GraphProfiler(path=os.path.join(directory, f"turn-{turn}.collapsed"),
+                                         verbose=False)
+                config["callbacks"] = [profiler]
+            start = time.perf_counter()
+            graph.invoke({"messages": [{"role": "user", "content": f"question {turn}"}]}, config)
+            turns[profile].append(time.perf_counter() - start)
+        # the profiler of this turn has written its file and reset its stats
+        with open(profiler.last_path) as file:
+            for line in file:
+                stack, count = line.rsplit(" ", 1)
+                frames = stack.split(";")
+                totals[(frames[1], frames[-1])] += int(count)
+        sampler_share.append(profiler.last_stats["sampler_seconds"]
+                             / profiler.last_stats["wall_seconds"])
+
+    plain, profiled = statistics.median(turns[False]), statistics.median(turns[True])
+    print(f">> median turn: {plain * 1000:.1f} ms without, {profiled * 1000:.1f} ms with "
+          f"profiling ({profiled / plain - 1:+.1%}), sampler time "
+          f"{statistics.mean(sampler_share):.2%} of the run")
+    print(">> heaviest leaf frames per node:")
+    for (node, frame), count in totals.most_common(8):
+        print(f"   {count:5} {node:15} {frame}")
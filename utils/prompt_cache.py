@@ -0,0 +1,119 @@
+import threading
+from collections import defaultdict
+
+from langchain_anthropic.chat_models import convert_to_anthropic_tool
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.runnables import RunnableLambda
+
+
+# Prompt-prefix caching ---------------------------------------------------
+#
+# System prompts, bound tool schemas and the RAG prompt template are the same
+# on every request. Anthropic can cache such a prefix if it is marked with a
+# `cache_control` block: later requests then read it from the cache (cheaper
+# and faster) instead of processing it again. The cache is checked in the
+# order tools -> system -> messages, and prefixes below the model's minimum
+# cacheable length (1024 tokens for sonnet/opus, 2048 for haiku) are simply
+# not cached.
+#
+# None of the prompts shipped with the examples reaches that length (the
+# advisor system prompts are about 40 tokens, the tool schemas and the static
+# part of rlm/rag-prompt are small), so the examples do not use these helpers:
+# marking them would never create a cache entry. Use them for prompts with
+# long, stable instructions, examples or documents, and check with
+# `cache_usage` that cache reads actually show up.
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+# system prompt as a single cacheable text block
+def cached_system_message(text: str) -> SystemMessage:
+    return SystemMessage(
+        content=[{"type": "text", "text": text, "cache_control": CACHE_CONTROL}]
+    )
+
+
+# bind tools with a cache breakpoint after the last tool schema, so all tool
+# definitions are cached together
+def bind_tools_cached(llm, tools: list, **kwargs):
+    tool_schemas = [convert_to_anthropic_tool(tool) for tool in tools]
+    if tool_schemas:
+        tool_schemas[-1]["cache_control"] = CACHE_CONTROL
+    return llm.bind_tools(tool_schemas, **kwargs)
+
+
+# For a prompt template like `rlm/rag-prompt` the static instructions come
+# before the first variable. After formatting, split the first message into
+# that static part (marked cacheable) and the rest.
+def cacheable_prompt(prompt):
+    first_template = prompt.messages[0].prompt.template
+    static_prefix = first_template.split("{", 1)[0]
+
+    def _split(prompt_value: ChatPromptValue) -> ChatPromptValue:
+        messages = list(prompt_value.to_messages())
+        first = messages[0]
+        if not static_prefix or not isinstance(first.content, str) \
+                or not first.content.startswith(static_prefix):
+            return prompt_value
+        content = [
+            {"type": "text", "text": static_prefix, "cache_control": CACHE_CONTROL},
+            {"type": "text", "text": first.content[len(static_prefix):]},
+        ]
+        if isinstance(first, SystemMessage):
+            messages[0] = SystemMessage(content=content)
+        else:
+            messages[0] = HumanMessage(content=content)
+        return ChatPromptValue(messages=messages)
+
+    return prompt | RunnableLambda(_split)
+
+
+# Cache usage per node --------------------------------------------------------
+
+# Callback that sums up cache-read, cache-write and uncached input tokens per
+# graph node. Pass it in the graph config: {"callbacks": [cache_usage]}
+class CacheUsageTracker(BaseCallbackHandler):
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._nodes_by_run = {}
+        self.usage = defaultdict(
+            lambda: {"calls": 0, "cache_read": 0, "cache_creation": 0, "uncached": 0}
+        )
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", "<no node>")
+        with self._lock:
+            self._nodes_by_run[run_id] = node
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            node = self._nodes_by_run.pop(run_id, "<no node>")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if not usage:
+                    continue
+                details = usage.get("input_token_details", {})
+                cache_read = details.get("cache_read") or 0
+                cache_creation = details.get("cache_creation") or 0
+                with self._lock:
+                    totals = self.usage[node]
+                    totals["calls"] += 1
+                    totals["cache_read"] += cache_read
+                    totals["cache_creation"] += cache_creation
+                    totals["uncached"] += usage["input_tokens"] - cache_read - cache_creation
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._nodes_by_run.pop(run_id, None)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {node: dict(totals) for node, totals in self.usage.items()}
+
+
+# one tracker per process, shared by the example scripts
+cache_usage = CacheUsageTracker()
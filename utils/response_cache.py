@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.outputs import ChatGeneration
+
+from utils.serde import get_serde
+
+
+# Record/replay cache for model responses -----------------------------------
+#
+# Regression runs, replays and load tests send the same prompts again and
+# again. DiskResponseCache plugs into LangChain's own cache hook of the chat
+# model (`llm.cache`), so it sees every call - plain invoke, bind_tools and
+# with_structured_output - with the key LangChain computes for it:
+#
+#   sha256(messages without ids, model + call params incl. bound tools)
+#
+# Responses are kept in a local SQLite file and the least recently used
+# entries are evicted once the file grows beyond `max_bytes`. Modes:
+#
+# * "record" - answer from the cache, call the model on a miss and store it
+# * "replay" - answer from the cache only; a miss raises ResponseCacheMiss,
+#              so a replay never touches the network
+#
+# get_chat_model() (utils/clients.py) and the Tavily tool (utils/tavily.py)
+# switch it on for all graphs via environment variables:
+#
+#   LLM_RESPONSE_CACHE=record|replay      (unset or "off": no cache)
+#   LLM_RESPONSE_CACHE_PATH=llm_cache.sqlite
+#   LLM_RESPONSE_CACHE_MAX_MB=256
+#
+# A cached response is one complete message, so cached models do not stream:
+# stream() yields the whole message as a single chunk.
+
+MODES = ("record", "replay")
+
+
+class ResponseCacheMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def _key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class DiskResponseCache(BaseCache):
+
+    def __init__(self, path: str = "llm_cache.sqlite", mode: str = "record",
+                 max_bytes: int = 256 * 1024 * 1024) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, choose one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self._serde = get_serde("msgpack")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_by_last_used
+                    ON responses (last_used);
+                """
+            )
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    # raw values ---------------------------------------------------------
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT type, value FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+                    )
+        if row is None:
+            if self.mode == "replay":
+                raise ResponseCacheMiss(f"No recorded response for key {key[:12]}...")
+            return None
+        return self._serde.loads_typed(row)
+
+    def put(self, key: str, value) -> None:
+        type_, data = self._serde.dumps_typed(value)
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, type, value, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, type_, data, len(data), time.time()),
+            )
+            self._size += len(data) - (old[0] if old else 0)
+            self._evict()
+
+    # drop the least recently used entries until 90% of max_bytes are left
+    def _evict(self) -> None:
+        if self._size <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used")
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.stats["evicted"] += len(evicted)
+
+    # LangChain cache interface (called by the chat model) ----------------
+
+    def lookup(self, prompt: str, llm_string: str):
+        value = self.get(_key(prompt, llm_string))
+        if value is None:
+            return None
+        return [
+            ChatGeneration(message=message, generation_info=info) for message, info in value
+        ]
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        self.put(
+            _key(prompt, llm_string),
+            [[generation.message, generation.generation_info] for generation in return_val],
+        )
+
+    def clear(self, **kwargs) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+# the chat model with the cache attached; the copy shares the HTTP clients
+# of the original model
+def cached_model(llm, cache: DiskResponseCache):
+    return llm.model_copy(update={"cache": cache, "disable_streaming": True})
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# process-wide cache configured by the environment variables above, or None
+def get_response_cache():
+    global _cache
+    mode = os.environ.get("LLM_RESPONSE_CACHE", "off").lower()
+    if mode in ("", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskResponseCache(
+                path=os.environ.get("LLM_RESPONSE_CACHE_PATH", "llm_cache.sqlite"),
+                mode=mode,
+                max_bytes=int(float(os.environ.get("LLM_RESPONSE_CACHE_MAX_MB", 256)) * 1024 * 1024),
+            )
+        return _cache
+
+
+# cached call of an arbitrary function (e.g. a search API) under the
+# process-wide cache: `parts` identify the request
+def cached_call(function, *parts):
+    cache = get_response_cache()
+    if cache is None:
+        return function()
+    key = _key(*parts)
+    value = cache.get(key)
+    if value is None:
+        value = function()
+        cache.put(key, value)
+    return value
+
+
+async def acached_call(function, *parts):
+    cache = get_response_cache()
+    if cache is None:
+        return await function()
+    key = _key(*parts)
+    value = cache.get(key)
+    if value is None:
+        value = await function()
+        cache.put(key, value)
+    return value
@@ -0,0 +1,549 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+from langchain_core.callbacks import BaseCallbackManager
+from langchain_core.messages import convert_to_messages
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, ensure_config
+
+
+# Request scheduling in front of the chat model ------------------------------
+#
+# When many sessions hit the chatbot node at the same time, every one of them
+# fires its own `llm_with_tools.invoke(...)` and the provider answers bursts
+# with rate limit errors. The scheduler sits between the nodes and the model:
+#
+# * requests go into a bounded priority queue (interactive before batch)
+# * a fixed number of workers per provider drains it (concurrency limit)
+# * every call first takes requests + tokens from a per-minute token bucket
+# * identical prompts that are already in flight are only sent once
+#
+# Wrap a model (or a model with bound tools) with `scheduled(...)` and use it
+# exactly like the model itself (invoke, ainvoke, stream, astream). The priority is picked up from the graph
+# config: graph.invoke(..., {"configurable": {"priority": "batch"}})
+#
+# invoke/stream run on the worker threads. ainvoke/astream stay on the event
+# loop: they wait for a slot at a priority gate of that loop (at most
+# `max_concurrency` calls per loop) and await the model's async methods, so
+# async nodes never block a thread.
+#
+# Rate limit errors (429) are retried up to `max_retries` times with backoff.
+# The Anthropic SDK retries them as well (ChatAnthropic max_retries, default
+# 2), and the two stack: one scheduled call may reach the API
+# (1 + sdk retries) * (1 + scheduler retries) times. To leave all retries to
+# the scheduler, build the model with get_chat_model(..., max_retries=0).
+
+
+PRIORITIES = {"interactive": 0, "batch": 10}
+
+
+class SchedulerFull(Exception):
+    """Raised when the request queue is full and did not drain in time."""
+
+
+# classic token bucket that refills continuously up to `per_minute`
+class _Bucket:
+
+    def __init__(self, per_minute) -> None:
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now) -> None:
+        if self.capacity is None:
+            return
+        self.available = min(
+            self.capacity,
+            self.available + (now - self.updated) * self.capacity / 60.0,
+        )
+        self.updated = now
+
+    # seconds to wait until `amount` is available (0 if it is available now)
+    def wait_time(self, amount, now) -> float:
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        # requests bigger than the whole bucket are allowed once it is full
+        amount = min(amount, self.capacity)
+        missing = amount - self.available
+        return 0.0 if missing <= 0 else missing * 60.0 / self.capacity
+
+    def take(self, amount) -> None:
+        if self.capacity is not None:
+            self.available -= amount
+
+
+# requests-per-minute + tokens-per-minute limiter shared by all workers
+class RateLimiter:
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None) -> None:
+        self._lock = threading.Lock()
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+
+    # takes one request + `tokens` if available, else returns the seconds to wait
+    def _try_take(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self._requests.wait_time(1, now),
+                self._tokens.wait_time(tokens, now),
+            )
+            if wait == 0:
+                self._requests.take(1)
+                self._tokens.take(tokens)
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        while (wait := self._try_take(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> None:
+        while (wait := self._try_take(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    # correct the token estimate once the real usage is known
+    def settle(self, estimated: int, actual: int) -> None:
+        with self._lock:
+            self._tokens.take(actual - estimated)
+
+
+def _canonical_messages(model_input) -> list:
+    if isinstance(model_input, PromptValue):
+        messages = model_input.to_messages()
+    elif isinstance(model_input, str):
+        return [["human", model_input]]
+    else:
+        messages = convert_to_messages(model_input)
+    # message ids differ between threads, so leave them out of the key
+    return [
+        [
+            m.type,
+            m.content,
+            getattr(m, "tool_calls", None),
+            getattr(m, "tool_call_id", None),
+            m.name,
+        ]
+        for m in messages
+    ]
+
+
+# rough token count (4 characters per token) used for the tokens/min budget
+def _estimate_tokens(canonical: list) -> int:
+    return max(1, len(json.dumps(canonical, default=str)) // 4)
+
+
+# what besides the prompt decides whether two calls may share one answer:
+# the call kwargs (stop, ...), the tags and the callback handlers - a caller
+# with other handlers would not see its own callbacks fire
+def _call_identity(config, kwargs: dict) -> list:
+    config = config or {}
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        handlers = callbacks.handlers
+    else:
+        handlers = callbacks or []
+    return [sorted(id(handler) for handler in handlers), sorted(config.get("tags") or []), kwargs]
+
+
+def _rank(priority) -> int:
+    if isinstance(priority, int) and not isinstance(priority, bool):
+        return priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority {priority!r}, choose one of {sorted(PRIORITIES)}")
+    return PRIORITIES[priority]
+
+
+def _copied(result):
+    return result.model_copy(deep=True) if hasattr(result, "model_copy") else result
+
+
+# every waiter gets its own copy of a shared result, because graph reducers
+# (e.g. add_messages) may modify the message objects they receive
+def _copy_of(future: Future) -> Future:
+    copy = Future()
+
+    def _done(source):
+        if source.exception() is not None:
+            copy.set_exception(source.exception())
+        else:
+            copy.set_result(_copied(source.result()))
+
+    future.add_done_callback(_done)
+    return copy
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+# priority gate for the async calls of one event loop: at most `limit` calls
+# run at a time, waiting callers are let in by priority (FIFO within one)
+class _AsyncGate:
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self._waiters = []    # heap of (priority, order, future)
+        self.in_flight = {}   # dedup key -> [task, number of callers waiting for it]
+
+    async def acquire(self, priority: int, order: int) -> None:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, order, future))
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over right before the cancel
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # the slot moves on to this waiter
+                return
+        self.active -= 1
+
+
+class ModelScheduler:
+    """Bounded priority queue + worker pool + rate limiter for one provider."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue_size: int = 256,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries: int = 3,
+    ) -> None:
+        self.settings = {
+            "max_concurrency": max_concurrency,
+            "max_queue_size": max_queue_size,
+            "requests_per_minute": requests_per_minute,
+            "tokens_per_minute": tokens_per_minute,
+            "max_retries": max_retries,
+        }
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self._queue = queue.PriorityQueue(maxsize=max_queue_size)
+        self._order = itertools.count()  # keeps FIFO order within a priority
+        self._in_flight = {}
+        self._gates = weakref.WeakKeyDictionary()  # event loop -> _AsyncGate
+        self._lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "deduplicated": 0,
+            "completed": 0,
+            "failed": 0,
+            "rate_limit_retries": 0,
+        }
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(max_concurrency)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # with `on_chunk`, the model is streamed and every chunk is handed to
+    # on_chunk (in the worker thread); the future gets the merged message
+    def _key(self, runnable, canonical: list, config, kwargs: dict) -> str:
+        return hashlib.sha256(
+            json.dumps([id(runnable), canonical, _call_identity(config, kwargs)],
+                       default=str, sort_keys=True).encode()
+        ).hexdigest()
+
+    def submit(self, runnable, model_input, config=None, priority="interactive",
+               timeout=None, on_chunk=None, **kwargs) -> Future:
+        rank = _rank(priority)
+        canonical = _canonical_messages(model_input)
+        key = self._key(runnable, canonical, config, kwargs)
+        if on_chunk is not None:
+            key = (key, next(self._order))  # streams are never shared
+
+        with self._lock:
+            self.stats["submitted"] += 1
+            # the same prompt is already on its way - share its result
+            if key in self._in_flight:
+                self.stats["deduplicated"] += 1
+                return _copy_of(self._in_flight[key])
+            future = Future()
+            self._in_flight[key] = future
+
+        job = (runnable, model_input, config, kwargs, _estimate_tokens(canonical), key, future,
+               on_chunk)
+        try:
+            self._queue.put((rank, next(self._order), job), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                del self._in_flight[key]
+            raise SchedulerFull(
+                f"Request queue is full ({self._queue.maxsize} pending requests)"
+            ) from None
+        return future
+
+    def _work(self) -> None:
+        while True:
+            _, _, job = self._queue.get()
+            runnable, model_input, config, kwargs, estimated, key, future, on_chunk = job
+            try:
+                result = self._call(runnable, model_input, config, kwargs, estimated, on_chunk)
+            except Exception as error:
+                with self._lock:
+                    self.stats["failed"] += 1
+                    del self._in_flight[key]
+                future.set_exception(error)
+            else:
+                with self._lock:
+                    self.stats["completed"] += 1
+                    del self._in_flight[key]
+                future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    def _call(self, runnable, model_input, config, kwargs, estimated, on_chunk=None):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimated)
+            streamed = False
+            try:
+                if on_chunk is None:
+                    result = runnable.invoke(model_input, config, **kwargs)
+                else:
+                    result = None
+                    for chunk in runnable.stream(model_input, config, **kwargs):
+                        streamed = True
+                        on_chunk(chunk)
+                        result = chunk if result is None else result + chunk
+            except Exception as error:
+                # a stream that already produced chunks cannot be replayed
+                if (attempt == self.max_retries or streamed
+                        or not _is_rate_limit_error(error)):
+                    raise
+                with self._lock:
+                    self.stats["rate_limit_retries"] += 1
+                time.sleep(2 ** attempt)
+                continue
+            self._settle(result, estimated)
+            return result
+
+    def _settle(self, result, estimated: int) -> None:
+        usage = getattr(result, "usage_metadata", None)
+        if usage:
+            self.rate_limiter.settle(estimated, usage["total_tokens"])
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+
+    # async path --------------------------------------------------------
+
+    def _gate(self) -> _AsyncGate:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._gates:
+                self._gates[loop] = _AsyncGate(self.settings["max_concurrency"])
+            return self._gates[loop]
+
+    # waits (without blocking the loop) for a slot of the loop's gate; a full
+    # gate raises SchedulerFull right away instead of waiting for room
+    async def _enter(self, gate: _AsyncGate, rank: int) -> None:
+        if gate.waiting >= self._queue.maxsize > 0:
+            raise SchedulerFull(
+                f"Request queue is full ({gate.waiting} pending async requests)"
+            )
+        await gate.acquire(rank, next(self._order))
+
+    async def arun(self, runnable, model_input, config=None, priority="interactive", **kwargs):
+        """Async counterpart of submit(...).result(): awaits `runnable.ainvoke`."""
+        rank = _rank(priority)
+        canonical = _canonical_messages(model_input)
+        key = self._key(runnable, canonical, config, kwargs)
+        gate = self._gate()
+        self._count("submitted")
+        shared = key in gate.in_flight
+        if shared:
+            self._count("deduplicated")
+        else:
+            task = asyncio.ensure_future(
+                self._acall(gate, rank, runnable, model_input, config, kwargs,
+                            _estimate_tokens(canonical))
+            )
+            gate.in_flight[key] = [task, 0]
+            task.add_done_callback(lambda _: gate.in_flight.pop(key, None))
+        entry = gate.in_flight[key]
+        task = entry[0]
+        # every caller only waits for the shared call: cancelling one caller
+        # cancels the call only if nobody else waits for it
+        entry[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+        return _copied(result) if shared else result
+
+    async def _acall(self, gate, rank, runnable, model_input, config, kwargs, estimated):
+        await self._enter(gate, rank)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.aacquire(estimated)
+                try:
+                    result = await runnable.ainvoke(model_input, config, **kwargs)
+                except Exception as error:
+                    if attempt == self.max_retries or not _is_rate_limit_error(error):
+                        self._count("failed")
+                        raise
+                    self._count("rate_limit_retries")
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                self._settle(result, estimated)
+                self._count("completed")
+                return result
+        finally:
+            gate.release()
+
+    async def astream(self, runnable, model_input, config=None, priority="interactive",
+                      **kwargs):
+        """Streams `runnable.astream` once a slot of the loop's gate is free."""
+        rank = _rank(priority)
+        estimated = _estimate_tokens(_canonical_messages(model_input))
+        gate = self._gate()
+        self._count("submitted")
+        await self._enter(gate, rank)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.aacquire(estimated)
+                result = None
+                try:
+                    async for chunk in runnable.astream(model_input, config, **kwargs):
+                        result = chunk if result is None else result + chunk
+                        yield chunk
+                except Exception as error:
+                    # a stream that already produced chunks cannot be replayed
+                    if (attempt == self.max_retries or result is not None
+                            or not _is_rate_limit_error(error)):
+                        self._count("failed")
+                        raise
+                    self._count("rate_limit_retries")
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                self._settle(result, estimated)
+                self._count("completed")
+                return
+        finally:
+            gate.release()
+
+
+# one scheduler per provider and process
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+# settings only apply to the first call for a provider; later calls with
+# other settings raise instead of silently getting the existing scheduler
+def get_scheduler(provider: str = "anthropic", **settings) -> ModelScheduler:
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            _schedulers[provider] = ModelScheduler(**settings)
+            return _schedulers[provider]
+        scheduler = _schedulers[provider]
+        conflicting = {
+            name: value for name, value in settings.items()
+            if scheduler.settings.get(name, value) != value or name not in scheduler.settings
+        }
+        if conflicting:
+            raise ValueError(
+                f"The {provider!r} scheduler already exists with {scheduler.settings}, "
+                f"cannot apply {conflicting}"
+            )
+        return scheduler
+
+
+_END_OF_STREAM = object()
+
+
+class ScheduledModel(Runnable):
+    """Runs every call of the wrapped model through a ModelScheduler."""
+
+    def __init__(self, bound, scheduler: ModelScheduler,
+                 default_priority: str = "interactive") -> None:
+        self.bound = bound
+        self.scheduler = scheduler
+        self.default_priority = default_priority
+
+    def _priority(self, config) -> str:
+        return config.get("configurable", {}).get("priority", self.default_priority)
+
+    def invoke(self, input, config=None, **kwargs):
+        # picks up the config of the calling graph node, so callbacks,
+        # tags and the priority are carried over to the worker thread
+        config = ensure_config(config)
+        future = self.scheduler.submit(
+            self.bound, input, config, priority=self._priority(config), **kwargs
+        )
+        return future.result()
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        return await self.scheduler.arun(
+            self.bound, input, config, priority=self._priority(config), **kwargs
+        )
+
+    # the chunks are produced in a scheduler worker and passed on through a
+    # queue, so streaming calls count against the same limits (astream runs
+    # on the event loop, see ModelScheduler.astream)
+    def stream(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        chunks = queue.Queue()
+        future = self.scheduler.submit(
+            self.bound, input, config, priority=self._priority(config),
+            on_chunk=chunks.put, **kwargs
+        )
+        future.add_done_callback(lambda _: chunks.put(_END_OF_STREAM))
+        while (chunk := chunks.get()) is not _END_OF_STREAM:
+            yield chunk
+        future.result()  # raises the error of a failed stream
+
+    async def astream(self, input, config=None, **kwargs):
+        config = ensure_config(config)
+        async for chunk in self.scheduler.astream(
+            self.bound, input, config, priority=self._priority(config), **kwargs
+        ):
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs):
+        return ScheduledModel(
+            self.bound.bind_tools(tools, **kwargs), self.scheduler, self.default_priority
+        )
+
+    def with_structured_output(self, schema, **kwargs):
+        return ScheduledModel(
+            self.bound.with_structured_output(schema, **kwargs),
+            self.scheduler,
+            self.default_priority,
+        )
+
+
+def scheduled(llm, provider: str = "anthropic", default_priority: str = "interactive"):
+    return ScheduledModel(llm, get_scheduler(provider), default_priority)
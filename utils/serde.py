@@ -0,0 +1,240 @@
+import time
+
+import ormsgpack
+from langchain_core.messages import (
+    AIMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+
+# Compact binary serializer for checkpoints ---------------------------------
+#
+# The default JsonPlusSerializer stores every message as a pydantic object:
+# module path, class name and a dict with all field names and values
+# (including empty ones), and every tool call as a dict with its keys. A
+# 100-turn history repeats those names thousands of times on every
+# super-step.
+#
+# MessagePackSerializer writes the message types with a fixed schema instead:
+#
+#   ext code -> [content, id, name, ...]   (field order from _SCHEMAS,
+#                                           trailing default values dropped)
+#   tool call -> [name, args, id]
+#
+# Everything else (Send, pydantic models, datetimes, messages with extra
+# fields, ...) is written by the default serializer through its public
+# dumps_typed()/loads_typed() and embedded as one ext value, and checkpoints
+# written by the default serializer can still be read.
+#
+# What it buys (python -m utils.serde, 100-turn history): checkpoints are
+# about 30% smaller. Speed is a minor effect - dumps are about 10-35% faster,
+# loads only 0-10%.
+# Pick it for storage size and write-heavy use, not to speed up resuming
+# from a checkpoint.
+#
+# Select it on the checkpointer:
+#
+#   MemorySaver(serde=get_serde("msgpack"))
+#   SqliteSaver(conn, serde=get_serde("msgpack"))
+
+TYPE = "msgpack-messages"
+
+# ext code -> (message class, fields, default value of each field)
+# (codes start at 32 to stay clear of the codes of the default serializer)
+_SCHEMAS = {
+    32: (HumanMessage, ("content", "id", "name", "additional_kwargs", "response_metadata"),
+         ("", None, None, {}, {})),
+    33: (AIMessage, ("content", "id", "tool_calls", "usage_metadata", "response_metadata",
+                     "name", "invalid_tool_calls", "additional_kwargs"),
+         ("", None, [], None, {}, None, [], {})),
+    34: (ToolMessage, ("content", "tool_call_id", "id", "name", "status", "artifact",
+                       "additional_kwargs", "response_metadata"),
+         ("", "", None, None, "success", None, {}, {})),
+    35: (SystemMessage, ("content", "id", "name", "additional_kwargs", "response_metadata"),
+         ("", None, None, {}, {})),
+    36: (RemoveMessage, ("content", "id", "name", "additional_kwargs", "response_metadata"),
+         ("", None, None, {}, {})),
+}
+_CODES = {cls: code for code, (cls, _, _) in _SCHEMAS.items()}
+_TOOL_CALL_KEYS = {"name", "args", "id", "type"}
+# any value the schema has no slot for goes to the default serializer
+_FALLBACK = 31
+# the types ormsgpack would write on its own in a lossy way go to `default`
+_OPTION = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+    | ormsgpack.OPT_PASSTHROUGH_ENUM
+    | ormsgpack.OPT_PASSTHROUGH_UUID
+    | ormsgpack.OPT_REPLACE_SURROGATES
+)
+# per message class: the fields outside the schema and their defaults; a
+# message only fits the schema if all of them are still at their default
+_OTHER_FIELDS = {
+    cls: [(name, field.get_default(call_default_factory=True))
+          for name, field in cls.model_fields.items()
+          if name not in fields and name != "type"]
+    for cls, fields, _ in _SCHEMAS.values()
+}
+
+
+def _fits_schema(message) -> bool:
+    return not message.__pydantic_extra__ and all(
+        getattr(message, name) == default for name, default in _OTHER_FIELDS[type(message)]
+    )
+
+
+def _pack_tool_calls(tool_calls: list) -> list:
+    return [
+        [call["name"], call["args"], call.get("id")]
+        if call.keys() <= _TOOL_CALL_KEYS and call.get("type", "tool_call") == "tool_call"
+        else call
+        for call in tool_calls
+    ]
+
+
+def _unpack_tool_calls(tool_calls: list) -> list:
+    return [
+        {"name": call[0], "args": call[1], "id": call[2], "type": "tool_call"}
+        if isinstance(call, list)
+        else call
+        for call in tool_calls
+    ]
+
+
+class MessagePackSerializer(JsonPlusSerializer):
+
+    def _pack_default(self, obj):
+        code = _CODES.get(type(obj))  # exact type: subclasses keep their class
+        if code is None or not _fits_schema(obj):
+            return ormsgpack.Ext(_FALLBACK, self._pack(list(super().dumps_typed(obj))))
+        _, fields, defaults = _SCHEMAS[code]
+        values = [getattr(obj, field) for field in fields]
+        if code == 33:
+            values[2] = _pack_tool_calls(values[2])
+        while values and values[-1] == defaults[len(values) - 1]:
+            values.pop()
+        return ormsgpack.Ext(code, self._pack(values))
+
+    def _pack(self, obj) -> bytes:
+        return ormsgpack.packb(obj, default=self._pack_default, option=_OPTION)
+
+    def _unpack_hook(self, code: int, data: bytes):
+        if code == _FALLBACK:
+            type_, data_ = self._unpack(data)
+            return super().loads_typed((type_, data_))
+        cls, fields, defaults = _SCHEMAS[code]
+        values = self._unpack(data)
+        # fresh dicts / lists, so that messages never share a default value
+        values.extend(
+            type(default)() if isinstance(default, (dict, list)) else default
+            for default in defaults[len(values):]
+        )
+        if code == 33:
+            values[2] = _unpack_tool_calls(values[2])
+        # the values were validated when the message was created
+        return cls.model_construct(**dict(zip(fields, values)))
+
+    def _unpack(self, data: bytes):
+        return ormsgpack.unpackb(data, ext_hook=self._unpack_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+
+    def dumps_typed(self, obj) -> tuple:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return super().dumps_typed(obj)
+        try:
+            return TYPE, self._pack(obj)
+        except ormsgpack.MsgpackEncodeError:
+            return super().dumps_typed(obj)
+
+    def loads_typed(self, data: tuple):
+        type_, data_ = data
+        if type_ == TYPE:
+            return self._unpack(data_)
+        return super().loads_typed(data)
+
+
+SERDES = {
+    "default": JsonPlusSerializer,
+    "msgpack": MessagePackSerializer,
+}
+
+
+def get_serde(name: str = "msgpack"):
+    if name not in SERDES:
+        raise ValueError(f"Unknown serde {name!r}, choose one of {sorted(SERDES)}")
+    return SERDES[name]()
+
+
+# Benchmark: python -m utils.serde -------------------------------------------
+#
+# A search-bot history as in 02-04: per turn a question, an answer with a
+# Tavily tool call, the Tavily result and the final answer. A checkpoint is
+# written after every super-step, so each history length is serialised once.
+
+def _history(turns: int) -> list:
+    import json
+    messages = []
+    for turn in range(turns):
+        call_id = f"toolu_{turn:024d}"
+        messages.append(HumanMessage(content=f"What is the weather in city {turn}?",
+                                     id=f"human-{turn}"))
+        messages.append(AIMessage(
+            content=[
+                {"type": "text", "text": "Let me search for the current weather."},
+                {"type": "tool_use", "id": call_id, "name": "tavily_search_results_json",
+                 "input": {"query": f"weather city {turn}"}},
+            ],
+            id=f"run-{turn}-0",
+            tool_calls=[{"name": "tavily_search_results_json",
+                         "args": {"query": f"weather city {turn}"}, "id": call_id}],
+            usage_metadata={"input_tokens": 400 + 60 * turn, "output_tokens": 80,
+                            "total_tokens": 480 + 60 * turn},
+            response_metadata={"id": f"msg_{turn:024d}", "model": "claude-3-haiku-20240307",
+                               "stop_reason": "tool_use", "stop_sequence": None},
+        ))
+        messages.append(ToolMessage(
+            content=json.dumps([{
+                "url": f"https://www.weatherapi.com/city-{turn}",
+                "content": "{'location': {'name': 'City', 'region': '', 'country': 'France', "
+                           "'lat': 48.87, 'lon': 2.33, 'localtime': '2024-10-19 12:00'}, "
+                           "'current': {'temp_c': 14.2, 'condition': {'text': 'Partly cloudy'}, "
+                           "'wind_kph': 11.2, 'humidity': 72, 'feelslike_c': 13.1}} " * 3,
+            }]),
+            name="tavily_search_results_json",
+            tool_call_id=call_id,
+            id=f"tool-{turn}",
+        ))
+        messages.append(AIMessage(
+            content=f"It is 14 degrees and partly cloudy in city {turn}.",
+            id=f"run-{turn}-1",
+            usage_metadata={"input_tokens": 900 + 60 * turn, "output_tokens": 25,
+                            "total_tokens": 925 + 60 * turn},
+            response_metadata={"id": f"msg_{turn:024d}b", "model": "claude-3-haiku-20240307",
+                               "stop_reason": "end_turn", "stop_sequence": None},
+        ))
+    return messages
+
+
+if __name__ == "__main__":
+    turns = 100
+    full = _history(turns)
+    # every super-step checkpoints the whole message list
+    checkpoints = [{"messages": full[:n]} for n in range(1, len(full) + 1)]
+
+    print(f">> {turns}-turn history, {len(full)} messages, {len(checkpoints)} checkpoints\n")
+    print(f"{'serde':10} {'bytes (last)':>13} {'bytes (total)':>14} {'dumps ms':>9} {'loads ms':>9}")
+    for name in SERDES:
+        serde = get_serde(name)
+        start = time.perf_counter()
+        dumped = [serde.dumps_typed(checkpoint) for checkpoint in checkpoints]
+        dumps_time = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = [serde.loads_typed(data) for data in dumped]
+        loads_time = time.perf_counter() - start
+        assert loaded[-1] == checkpoints[-1], f"{name} does not round-trip"
+        print(f"{name:10} {len(dumped[-1][1]):13,} {sum(len(d[1]) for d in dumped):14,} "
+              f"{dumps_time * 1000:9.1f} {loads_time * 1000:9.1f}")
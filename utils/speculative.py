@@ -0,0 +1,270 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages.utils import message_chunk_to_message
+
+
+# Speculative tool execution -------------------------------------------------
+#
+# Normally the tool node only starts after the chatbot node has received the
+# whole AIMessage. When the model is streamed, the arguments of every tool
+# call arrive piece by piece - and once they form a complete JSON object, the
+# call is fixed and can already run while the model is still generating the
+# rest of the message (more tool calls, closing text, usage data):
+#
+#   chatbot:  [text ...][call 1 args][call 2 args][rest]
+#   tool 1:                          [------ search ------]
+#   tool 2:                                       [------ search ------]
+#
+# The started calls are kept by tool_call_id. The tool node takes the result
+# of a started call instead of calling the tool again - but only if the final
+# message contains a tool call with the same id, name and arguments. Anything
+# else (a failed stream, a call that did not make it into the final message,
+# a result nobody picked up) is discarded.
+#
+# Only pass side-effect free tools (like a web search): a discarded call has
+# still run.
+#
+# The started calls run with the config passed to stream()/astream() - pass
+# the chatbot node's config, so they show up (callbacks, tracing, tags) under
+# the node that started them, like any other call made by the node.
+#
+# One executor serves every session that uses it: its `max_workers` threads
+# bound how many tool calls run at once in total, and further calls queue up
+# behind them. Size it for the concurrency (and rate limit) of the tool API.
+
+
+def _complete_args(args: str):
+    # parses only once the JSON object is closed: unlike the partial parsing
+    # of AIMessageChunk.tool_calls, '{"query": "wea' is not complete
+    try:
+        args = json.loads(args)
+    except ValueError:
+        return None
+    return args if isinstance(args, dict) else None
+
+
+# tool call chunks of a (partial) message; a model that does not stream
+# (e.g. one with a response cache) yields the whole AIMessage at once
+def _tool_call_chunks(message) -> list:
+    if hasattr(message, "tool_call_chunks"):
+        return message.tool_call_chunks
+    return [
+        {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+        for i, call in enumerate(message.tool_calls)
+    ]
+
+
+class SpeculativeToolExecutor:
+
+    def __init__(self, tools: list, max_workers: int = 4, max_age: float = 300.0) -> None:
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_age = max_age
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="speculative-tool")
+        self._lock = threading.Lock()
+        self._started = {}  # tool_call_id -> (name, args, future, started at)
+        self.stats = {"started": 0, "used": 0, "discarded": 0}
+
+    # start every tool call of the (partial) message whose arguments are complete
+    def _start_complete_calls(self, message, start) -> None:
+        for chunk in _tool_call_chunks(message):
+            call_id, name = chunk.get("id"), chunk.get("name")
+            if not call_id or name not in self.tools_by_name:
+                continue
+            with self._lock:
+                if call_id in self._started:
+                    continue
+            args = _complete_args(chunk.get("args") or "")
+            if args is None:
+                continue
+            future = start(self.tools_by_name[name], args)
+            with self._lock:
+                self._started[call_id] = (name, args, future, time.monotonic())
+                self.stats["started"] += 1
+
+    def _discard(self, call_ids) -> None:
+        with self._lock:
+            entries = [self._started.pop(call_id) for call_id in call_ids
+                       if call_id in self._started]
+            self.stats["discarded"] += len(entries)
+        for _, _, future, _ in entries:
+            future.cancel()  # only stops calls that have not started yet
+
+    # keep the started calls that are part of the final message, drop the
+    # others and everything that was never picked up by a tool node
+    def _settle(self, message, call_ids: set) -> None:
+        final = {call["id"]: (call["name"], call["args"]) for call in message.tool_calls}
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                call_id for call_id, (name, args, _, started) in self._started.items()
+                if (call_id in call_ids and final.get(call_id) != (name, args))
+                or now - started > self.max_age
+            ]
+        self._discard(stale)
+
+    def stream(self, llm, messages, config=None):
+        """Stream the model's answer and start tool calls as soon as their
+        arguments are complete; model and tool calls run with `config`.
+        Returns the final AIMessage."""
+        full = None
+        try:
+            for chunk in llm.stream(messages, config):
+                full = chunk if full is None else full + chunk
+                self._start_complete_calls(
+                    full, lambda tool, args: self._pool.submit(tool.invoke, args, config)
+                )
+        except BaseException:
+            self._discard([chunk["id"] for chunk in (_tool_call_chunks(full) if full else [])])
+            raise
+        message = message_chunk_to_message(full)
+        self._settle(message, {chunk["id"] for chunk in _tool_call_chunks(full)})
+        return message
+
+    async def astream(self, llm, messages, config=None):
+        full = None
+        try:
+            async for chunk in llm.astream(messages, config):
+                full = chunk if full is None else full + chunk
+                self._start_complete_calls(
+                    full, lambda tool, args: asyncio.ensure_future(tool.ainvoke(args, config))
+                )
+        except BaseException:
+            self._discard([chunk["id"] for chunk in (_tool_call_chunks(full) if full else [])])
+            raise
+        message = message_chunk_to_message(full)
+        self._settle(message, {chunk["id"] for chunk in _tool_call_chunks(full)})
+        return message
+
+    # the started call for this tool call, or None if it has to be run now
+    def take(self, tool_call: dict):
+        with self._lock:
+            entry = self._started.get(tool_call["id"])
+            if entry is None or entry[:2] != (tool_call["name"], tool_call["args"]):
+                return None
+            del self._started[tool_call["id"]]
+            self.stats["used"] += 1
+        return entry[2]
+
+    def invoke(self, tool_call: dict, config=None):
+        future = self.take(tool_call)
+        if future is None:
+            return self.tools_by_name[tool_call["name"]].invoke(tool_call["args"], config)
+        return future.result()
+
+    async def ainvoke(self, tool_call: dict, config=None):
+        future = self.take(tool_call)
+        if future is None:
+            return await self.tools_by_name[tool_call["name"]].ainvoke(tool_call["args"], config)
+        # thread pool future (started by stream) or task (started by astream)
+        return await asyncio.wrap_future(future)
+
+
+# Benchmark: python -m utils.speculative -------------------------------------
+#
+# A fake streaming model answers with some text and two search calls (one
+# chunk every 20 ms, like a model producing ~50 tokens/s), the fake search
+# takes 400 ms. A turn is "chatbot node + tool node", with a tool node that
+# runs the calls one after the other (BasicToolNode.__call__) or concurrently
+# (BasicToolNode.acall).
+
+if __name__ == "__main__":
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.tools import tool as make_tool
+
+    CHUNK_DELAY, TOOL_DELAY = 0.02, 0.4
+
+    @make_tool
+    def search(query: str) -> str:
+        """Fake web search."""
+        time.sleep(TOOL_DELAY)
+        return f"results for {query}"
+
+    def chunks():
+        text = "Let me look up both cities for you before I answer ".split(" ")
+        for word in text:
+            yield AIMessageChunk(content=word + " ")
+        for index, (call_id, city) in enumerate([("call_1", "Paris"), ("call_2", "Berlin")]):
+            args = json.dumps({"query": f"weather in {city} today"})
+            yield AIMessageChunk(content="", tool_call_chunks=[
+                {"name": "search", "args": "", "id": call_id, "index": index}])
+            for start in range(0, len(args), 4):
+                yield AIMessageChunk(content="", tool_call_chunks=[
+                    {"name": None, "args": args[start:start + 4], "id": None, "index": index}])
+        for _ in range(5):  # stop reason, usage, ...
+            yield AIMessageChunk(content="")
+
+    class SlowStreamingModel(GenericFakeChatModel):
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            from langchain_core.outputs import ChatGenerationChunk
+            for chunk in chunks():
+                time.sleep(CHUNK_DELAY)
+                yield ChatGenerationChunk(message=chunk)
+
+    llm = SlowStreamingModel(messages=iter([]))
+
+    def run_tools(message, executor, concurrent):
+        if not concurrent:
+            return [executor.invoke(tool_call) for tool_call in message.tool_calls]
+        with ThreadPoolExecutor(4) as pool:
+            return list(pool.map(executor.invoke, message.tool_calls))
+
+    def turn(speculate: bool, concurrent: bool) -> float:
+        executor = SpeculativeToolExecutor([search])
+        start = time.perf_counter()
+        if speculate:
+            message = executor.stream(llm, "weather?")
+        else:
+            full = None
+            for chunk in llm.stream("weather?"):
+                full = chunk if full is None else full + chunk
+            message = message_chunk_to_message(full)
+        results = run_tools(message, executor, concurrent)
+        assert isinstance(message, AIMessage) and len(results) == 2
+        return time.perf_counter() - start
+
+    print(f"{'tool node':12} {'speculation':>11} {'median turn latency':>20}")
+    for concurrent in (False, True):
+        for speculate in (False, True):
+            timings = sorted(turn(speculate, concurrent) for _ in range(5))
+            print(f"{'concurrent' if concurrent else 'sequential':12} "
+                  f"{'on' if speculate else 'off':>11} {timings[2] * 1000:17.0f} ms")
+
+    # async path: astream() starts tasks, ainvoke() awaits them
+    async def aturn():
+        executor = SpeculativeToolExecutor([search])
+        message = await executor.astream(llm, "weather?")
+        await asyncio.gather(*(executor.ainvoke(call) for call in message.tool_calls))
+        return executor.stats
+    print(f"\n>> async turn: {asyncio.run(aturn())}")
+
+    # a call that does not end up in the final message is dropped
+    executor = SpeculativeToolExecutor([search])
+    executor._start_complete_calls(
+        AIMessageChunk(content="", tool_call_chunks=[
+            {"name": "search", "args": '{"query": "x"}', "id": "call_x", "index": 0}]),
+        lambda tool, args: executor._pool.submit(tool.invoke, args),
+    )
+    executor._settle(AIMessage(content="no tools after all"), {"call_x"})
+    print(f">> mismatch: {executor.stats}")
+
+    # started calls run with the config of the node that streamed the model
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class ToolStarts(BaseCallbackHandler):
+        def __init__(self):
+            self.names = []
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.names.append(serialized.get("name"))
+
+    handler = ToolStarts()
+    executor = SpeculativeToolExecutor([search])
+    message = executor.stream(llm, "weather?", {"callbacks": [handler]})
+    run_tools(message, executor, concurrent=False)
+    assert handler.names == ["search", "search"], handler.names
+    print(f">> config passed to started calls: {handler.names}")
@@ -0,0 +1,59 @@
+import inspect
+
+from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_community.utilities.tavily_search import (
+    TAVILY_API_URL,
+    TavilySearchAPIWrapper,
+)
+
+from utils.clients import get_async_http_client, get_http_client
+from utils.response_cache import acached_call, cached_call
+
+
+# Tavily search tool on the shared connection pool ----------------------
+
+# the parameters (and their defaults) of the upstream search call
+_SEARCH_SIGNATURE = inspect.signature(TavilySearchAPIWrapper.raw_results)
+
+
+# Tavily wrapper that sends its requests through the shared pool instead of
+# opening a new connection with `requests.post` for every search. Only the
+# HTTP part is replaced: the request parameters are those of the upstream
+# raw_results(), with its defaults.
+class PooledTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+
+    def _search_params(self, query: str, **kwargs) -> dict:
+        arguments = _SEARCH_SIGNATURE.bind(self, query, **kwargs)
+        arguments.apply_defaults()
+        params = dict(arguments.arguments)
+        del params["self"]
+        return {"api_key": self.tavily_api_key.get_secret_value(), **params}
+
+    def raw_results(self, query: str, **kwargs) -> dict:
+        params = self._search_params(query, **kwargs)
+
+        def search():
+            response = get_http_client().post(f"{TAVILY_API_URL}/search", json=params)
+            response.raise_for_status()
+            return response.json()
+
+        # recorded / replayed like the model responses if LLM_RESPONSE_CACHE is set
+        return cached_call(search, "tavily", {**params, "api_key": None})
+
+    async def raw_results_async(self, query: str, **kwargs) -> dict:
+        params = self._search_params(query, **kwargs)
+
+        async def search():
+            response = await get_async_http_client().post(
+                f"{TAVILY_API_URL}/search", json=params
+            )
+            response.raise_for_status()
+            return response.json()
+
+        return await acached_call(search, "tavily", {**params, "api_key": None})
+
+
+def get_tavily_tool(max_results: int = 1) -> TavilySearchResults:
+    return TavilySearchResults(
+        max_results=max_results, api_wrapper=PooledTavilySearchAPIWrapper()
+    )